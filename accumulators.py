@@ -0,0 +1,98 @@
+"""
+Streaming statistics of the simulation observables with O(1) update and query and a fixed memory footprint.
+"""
+from typing import Dict, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+
+class RunningStats:
+    def __init__(self, window: int, shape: Tuple[int, ...] = ()):
+        """
+        Running mean and variance of all the pushed values (Welford's algorithm)
+        and means over the last frames_c <= window values.
+        The windowed means are differences of prefix sums kept in a ring of window + 1 entries,
+        the ring is rebased every window pushes so the prefix sums never grow large
+        :param window: max frames_c of the windowed queries
+        :param shape: shape of one value, e.g. (M, ) for the ensemble of M replicas
+        """
+        if window < 1:
+            raise ValueError("window must be positive")
+        self.window = window
+        self.shape = tuple(shape)
+        self._count = 0
+        self._mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self._prefix = np.zeros((window + 1, ) + self.shape)
+        self._last = np.zeros(self.shape)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, value: Union[float, ndarray]):
+        self._count += 1
+        delta = value - self._mean
+        self._mean = self._mean + delta / self._count
+        self._m2 = self._m2 + delta * (value - self._mean)
+        self._last = value
+
+        size = self.window + 1
+        self._prefix[self._count % size] = self._prefix[(self._count - 1) % size] + value
+        if self._count % self.window == 0:
+            # The oldest needed prefix sum becomes zero
+            self._prefix -= self._prefix[(self._count + 1) % size].copy()
+
+    def mean(self, frames_c: Union[int, None] = None) -> Union[float, ndarray]:
+        """
+        :param frames_c: if frames_c is None then the mean of all the values is returned,
+        otherwise the mean of the last frames_c of them
+        """
+        if self._count == 0:
+            return np.full(self.shape, np.nan) if self.shape else float('nan')
+        if frames_c is None:
+            return self._mean.copy() if self.shape else float(self._mean)
+        if not 0 < frames_c <= self.window:
+            raise ValueError(f"frames_c must be in [1, {self.window}]")
+        frames_c = min(frames_c, self._count)
+        size = self.window + 1
+        mean = (self._prefix[self._count % size] - self._prefix[(self._count - frames_c) % size]) / frames_c
+        return mean if self.shape else float(mean)
+
+    def var(self) -> Union[float, ndarray]:
+        """
+        :return: sample variance of all the values
+        """
+        if self._count < 2:
+            return np.full(self.shape, np.nan) if self.shape else float('nan')
+        var = self._m2 / (self._count - 1)
+        return var if self.shape else float(var)
+
+    def last(self) -> Union[float, ndarray]:
+        return self._last
+
+    def _live(self) -> ndarray:
+        """
+        :return: positions of the prefix sums the queries can still read, from the oldest one
+        """
+        filled = min(self._count, self.window) + 1
+        return (self._count - np.arange(filled - 1, -1, -1)) % (self.window + 1)
+
+    def state(self) -> Dict[str, ndarray]:
+        """
+        :return: arrays of the full accumulator state, see from_state,
+        the ring is saved up to the number of the pushed values
+        """
+        return dict(counters=np.array([self._count, self.window], dtype=np.int64),
+                    moments=np.stack([np.asarray(self._mean, dtype=float), np.asarray(self._m2, dtype=float),
+                                      np.asarray(self._last, dtype=float)]),
+                    prefix=self._prefix[self._live()])
+
+    @classmethod
+    def from_state(cls, state: Dict[str, ndarray]):
+        count, window = (int(c) for c in state['counters'])
+        stats = cls(window, state['prefix'].shape[1:])
+        stats._count = count
+        stats._mean, stats._m2, stats._last = (np.array(m) for m in state['moments'])
+        stats._prefix[stats._live()] = state['prefix']
+        return stats
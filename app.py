@@ -1,3 +1,4 @@
+import multiprocessing
 import pygame
 import screeninfo
 import config
@@ -5,6 +6,7 @@ from menu_screen import MenuScreen
 from authors_screen import AuthorsScreen
 from demo_screen import DemoScreen
 from theory_screen import TheoryScreen
+from profiling import FrameProfiler
 
 
 class App:
@@ -14,6 +16,10 @@ class App:
         monitor.height -= 1
         self.monitor = monitor
         self.screen = pygame.display.set_mode((0, 0))
+        self._config = config.ConfigLoader()
+        # Frame-time breakdown, F3 toggles its overlay on the demo screen
+        self.frame_profiler = FrameProfiler()
+        self.frame_profiler.visible = self._config['profiler_hud']
         self.menu_screen = MenuScreen(self)
         self.authors_screen = AuthorsScreen(self)
         self.theory_screen = TheoryScreen(self)
@@ -22,21 +28,54 @@ class App:
 
         self.active_screen = self.menu_screen
 
-        self._config = config.ConfigLoader()
+    def close(self):
+        """
+        Stops the simulation runners, the screens are rebuilt or the app exits after that
+        """
+        self.demo_screen.close()
 
     def run(self):
         """Запуск основного цикла игры."""
+        try:
+            self._run()
+        finally:
+            self.close()
+
+    def _run(self):
+        profiler = self.frame_profiler
+        shown = None
         while True:
+            profiler.begin_frame()
             # Mouse and keyboard events handling
             self.active_screen._check_events()
-            self.active_screen._update_screen()
+            profiler.lap("events")
+            screen = self.active_screen
+            if screen is not shown and hasattr(screen, 'invalidate'):
+                screen.invalidate()
+            shown = screen
+            # The screens with the layered rendering return the changed areas
+            dirty = screen._update_screen()
+            profiler.lap("update")
+            restore = profiler.draw(self.screen, dirty)
+            profiler.lap("hud")
             # Отображение последнего прорисованного экрана.
-            pygame.display.flip()
+            if dirty is None:
+                pygame.display.flip()
+            else:
+                if restore is not None:
+                    # It's pushed by the next frame
+                    screen.invalidate(restore)
+                pygame.display.update(dirty)
+            profiler.lap("flip")
 
             fps = self._config['FPS']
             self.clock.tick(fps)
+            profiler.lap("tick")
+            profiler.end_frame()
 
 
 if __name__ == '__main__':
+    # The simulation server process of the frozen app starts from this module
+    multiprocessing.freeze_support()
     app = App()
     app.run()
@@ -1,6 +1,7 @@
 import pygame
 
 import language
+from text_cache import TextCache
 from button import Button
 
 class AuthorsScreen():
@@ -11,9 +12,9 @@ class AuthorsScreen():
         self.folder = '_internal/images/'
         self.bg_color = (255, 255, 255)
         self.font = 'sans'
-        self.little_font = pygame.font.SysFont(self.font, 38)
-        self.middle_font = pygame.font.SysFont(self.font, 40, bold=True)
-        self.big_font = pygame.font.SysFont(self.font, 50)
+        self.little_font = TextCache().font(self.font, 38)
+        self.middle_font = TextCache().font(self.font, 40, bold=True)
+        self.big_font = TextCache().font(self.font, 50)
         self.strings = [lang['university_name'],
                         lang['faculty_name'],
                         lang['lecturer'],
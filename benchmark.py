@@ -0,0 +1,199 @@
+"""
+Scaling benchmark of the Simulation engine, it never imports pygame.
+
+Every case of the (particles, R, R_spring, gamma) matrix is timed with a fixed seed, the steps per second
+and the peak memory allocated by the steps are written to a json file. The compare command flags
+the cases that got slower or use more memory than in the baseline file and the cases missing from either file.
+
+Usage: python benchmark.py run --out bench.json
+       python benchmark.py run --particles 50 1000 --gamma 1 --backend numba --out numba.json
+       python benchmark.py compare baseline.json bench.json --threshold 0.1
+"""
+import argparse
+import datetime
+import itertools
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+import config
+from simulation import Simulation
+
+CASE_KEYS = ("particles", "R", "R_spring", "gamma", "backend", "dtype", "integrator", "contact_mode")
+# Cases with the larger area fraction of the bath particles can't be placed without massive overlaps
+MAX_AREA_FRACTION = 0.5
+
+
+def make_simulation(particles: int, R: float, R_spring: float, gamma: float, seed: int, **kwargs) -> Simulation:
+    """
+    Simulation with the initial config parameters except the given ones
+    """
+    loader = config.ConfigLoader()
+    params = loader.initial_sim_params()
+    return Simulation(
+        gamma=gamma, k=params['k'], l_0=loader['l_0'], R=R, R_spring=R_spring,
+        particles_cnt=particles, spring_cnt=2, T=params['T'],
+        m=np.full((particles, ), loader['R_mass']), m_spring=np.full((2, ), loader['R_mass'] * params['m_spring']),
+        seed=seed, **kwargs
+    )
+
+
+def run_case(case: dict, seed: int, min_time: float, repeat: int, warmup: int, memory_steps: int) -> dict:
+    """
+    :return: case with the best steps per second of repeat timings, each of them lasts at least min_time,
+    and the peak memory allocated during memory_steps steps
+    """
+    kwargs = {key: case[key] for key in ("backend", "dtype", "integrator", "contact_mode")}
+    simulation = make_simulation(case["particles"], case["R"], case["R_spring"], case["gamma"], seed, **kwargs)
+    simulation.step_many(warmup)
+
+    best = 0.0
+    for _ in range(repeat):
+        steps, elapsed, block = 0, 0.0, 1
+        start = time.perf_counter()
+        while elapsed < min_time:
+            simulation.step_many(block)
+            steps += block
+            elapsed = time.perf_counter() - start
+            block *= 2
+        best = max(best, steps / elapsed)
+
+    tracemalloc.start()
+    simulation.step_many(memory_steps)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(case, steps_per_s=best, peak_bytes=peak,
+                state_bytes=simulation._r.nbytes + simulation._v.nbytes + simulation._m.nbytes)
+
+
+def make_cases(particles: List[int], R: List[float], R_spring: List[float], gamma: List[float],
+               backend: str, dtype: str, integrator: str, contact_mode: str) -> List[dict]:
+    cases = []
+    for n, r, r_spring, g in itertools.product(particles, R, R_spring, gamma):
+        if n * math.pi * r ** 2 > MAX_AREA_FRACTION:
+            print(f"skipped particles={n} R={r}: area fraction > {MAX_AREA_FRACTION}", file=sys.stderr)
+            continue
+        cases.append(dict(particles=n, R=r, R_spring=r_spring, gamma=g, backend=backend, dtype=dtype,
+                          integrator=integrator, contact_mode=contact_mode))
+    return cases
+
+
+def run(args: argparse.Namespace):
+    cases = make_cases(args.particles, args.R, args.R_spring, args.gamma,
+                       args.backend, args.dtype, args.integrator, args.contact_mode)
+    results = []
+    for case in cases:
+        result = run_case(case, args.seed, args.min_time, args.repeat, args.warmup, args.memory_steps)
+        results.append(result)
+        print(f"particles={case['particles']:>6} R={case['R']:<7} R_spring={case['R_spring']:<7} "
+              f"gamma={case['gamma']:<5} {result['steps_per_s']:>10.1f} steps/s "
+              f"peak {result['peak_bytes'] / 1024:>9.1f} KiB")
+
+    meta = dict(date=datetime.datetime.now().isoformat(timespec="seconds"), python=platform.python_version(),
+                numpy=np.__version__, machine=platform.machine(), platform=platform.platform(),
+                processor=platform.processor(), seed=args.seed, min_time=args.min_time, repeat=args.repeat)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"{len(results)} cases saved to {args.out}")
+
+
+def _case_key(result: dict) -> tuple:
+    return tuple(result[key] for key in CASE_KEYS)
+
+
+def compare_results(baseline: List[dict], current: List[dict], threshold: float) -> List[dict]:
+    """
+    :return: rows of the cases: speed and memory ratios current / baseline, the regression flag and the status,
+    "compared" if the case is in both lists, "missing" if only in the baseline and "new" if only in the current one,
+    the ratios of the last two are None. A case regresses if it is slower by more than threshold
+    or its peak memory is larger by more than threshold
+    """
+    base = {_case_key(result): result for result in baseline}
+    keys = {_case_key(result) for result in current}
+    rows = []
+    for result in current:
+        case = {key: result[key] for key in CASE_KEYS}
+        old = base.get(_case_key(result))
+        if old is None:
+            rows.append(dict(case=case, speed_ratio=None, memory_ratio=None, regression=False, status="new"))
+            continue
+        speed = result["steps_per_s"] / old["steps_per_s"]
+        memory = result["peak_bytes"] / max(old["peak_bytes"], 1)
+        rows.append(dict(case=case, speed_ratio=speed, memory_ratio=memory,
+                         regression=speed < 1 - threshold or memory > 1 + threshold, status="compared"))
+    for key, result in base.items():
+        if key not in keys:
+            rows.append(dict(case={key: result[key] for key in CASE_KEYS}, speed_ratio=None, memory_ratio=None,
+                             regression=False, status="missing"))
+    return rows
+
+
+def compare(args: argparse.Namespace):
+    results = []
+    for path in (args.baseline, args.current):
+        with open(path, "r", encoding="utf-8") as f:
+            results.append(json.load(f)["results"])
+    rows = compare_results(*results, args.threshold)
+    for row in rows:
+        case = row["case"]
+        line = (f"particles={case['particles']:>6} R={case['R']:<7} R_spring={case['R_spring']:<7} "
+                f"gamma={case['gamma']:<5} ")
+        if row["status"] == "missing":
+            print(line + "MISSING from the current file")
+        elif row["status"] == "new":
+            print(line + "NEW, not in the baseline file")
+        else:
+            print(line + f"speed x{row['speed_ratio']:.3f} memory x{row['memory_ratio']:.3f}"
+                         f"{'  REGRESSION' if row['regression'] else ''}")
+    regressions = sum(row["regression"] for row in rows)
+    unmatched = sum(row["status"] != "compared" for row in rows)
+    print(f"{len(rows) - unmatched} cases compared, {regressions} regressions, {unmatched} missing or new cases")
+    if args.out is not None:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"threshold": args.threshold, "rows": rows}, f, indent=2)
+    # Non-zero exit status lets the scripts fail on a regression or on the case matrices that don't match
+    sys.exit(1 if regressions or unmatched else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="time the cases and save the results")
+    run_parser.add_argument("--particles", type=int, nargs="+", default=[50, 200, 1000, 10_000])
+    run_parser.add_argument("--R", type=float, nargs="+", default=[0.002, 0.005, 0.01],
+                            help="radii of the bath particles")
+    run_parser.add_argument("--R-spring", type=float, nargs="+", default=[0.025], help="radii of the spring particles")
+    run_parser.add_argument("--gamma", type=float, nargs="+", default=[1.0, 2.0])
+    run_parser.add_argument("--backend", choices=Simulation.BACKENDS, default="numpy")
+    run_parser.add_argument("--dtype", choices=tuple(Simulation.DTYPES), default="float64")
+    run_parser.add_argument("--integrator", choices=Simulation.INTEGRATORS, default="euler")
+    run_parser.add_argument("--contact-mode", choices=Simulation.CONTACT_MODES, default="available")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--min-time", type=float, default=1.0, help="min duration of one timing, seconds")
+    run_parser.add_argument("--repeat", type=int, default=3, help="the best of repeat timings is saved")
+    run_parser.add_argument("--warmup", type=int, default=20, help="steps before the timings")
+    run_parser.add_argument("--memory-steps", type=int, default=5, help="steps traced for the peak memory")
+    run_parser.add_argument("--out", default="benchmark.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="flag the regressions against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="allowed relative slowdown and memory growth")
+    compare_parser.add_argument("--out", default=None, help="optional json file of the comparison")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,23 @@
 import pygame.font
 import pygame
 
+from text_cache import TextCache
+
 class Button():
     
     def __init__(self, app, msg, position, button_size, command = lambda: print('no action for button'), **kwargs):
         """Инициализирует атрибуты кнопки."""
         self.screen = app.screen
         self.screen_rect = self.screen.get_rect()
-        self.font = kwargs.get('font', 'corbel')
+        self.font_name = kwargs.get('font', 'corbel')
         # Назначение размеров и свойств кнопок.
         self.width, self.height = button_size
         self.command = command
         self.button_color = kwargs.get('button_color', (240, 240, 240))
         self.text_color = kwargs.get('text_color', (0, 0, 0))
-        self.font = pygame.font.SysFont(self.font, kwargs.get('fontSize', 36), kwargs.get('bold', True))
+        self.font_size = kwargs.get('fontSize', 36)
+        self.bold = kwargs.get('bold', True)
+        self.font = TextCache().font(self.font_name, self.font_size, self.bold)
 
         # Построение объекта rect кнопки и выравнивание по центру экрана.
         self.rect = pygame.Rect(*position, self.width, self.height)
@@ -22,7 +26,8 @@ class Button():
         self._prep_msg(msg)
     
     def _prep_msg(self, msg):
-        self.msg_image = self.font.render(msg, True, self.text_color,
+        self.msg = msg
+        self.msg_image = TextCache().render(msg, self.font_name, self.font_size, self.bold, self.text_color,
                                             self.button_color)
         self.msg_image_rect = self.msg_image.get_rect()
         self.msg_image_rect.center = self.rect.center
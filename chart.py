@@ -47,6 +47,7 @@ class Chart:
         self.const_buf = [const_val] * len_buf if const_val else None
         self.const_legend = 'const' if const_legend is None else const_legend
         self.const_func = const_func
+        self._rendered = None
 
     @property
     def const_val(self):
@@ -57,8 +58,23 @@ class Chart:
         self.const_buf = [new_val] * len(self.buf) if new_val else None
 
     def draw(self, params):
+        self.update(params)
+        self.render()
+
+    def update(self, params) -> bool:
+        """
+        Appends the new records of params to the buffer
+        :return: True if the chart differs from the last rendered one
+        """
         self.buf.extend(params[self.name])
 #       self._refresh_iter(params)
+        return self._state() != self._rendered
+
+    def _state(self):
+        return len(self.buf), self.const_func(), self.chart.ymin, self.chart.ymax
+
+    def render(self):
+        self._rendered = self._state()
         if len(self.buf) > 1:
             self.chart.add_title(f'{self.title}')
             self.chart.add_legend()
@@ -68,6 +84,8 @@ class Chart:
                             line_width=2)
             self.chart.line(self.title, list(range(1, len(self.buf) + 1)), self.buf.main, color=(242,133,0),line_width=3)
             self.chart.draw()
+            # Figure.draw shows the surface rendered by its previous call, the new one is shown at once
+            self.screen.blit(self.chart.background, (self.chart.x, self.chart.y))
             pygame.draw.rect(self.screen, self.bd_params[0], self.border, self.bd_params[1])
 
     def get_xlim(self):
@@ -0,0 +1,137 @@
+"""
+Headless command-line entry point, it never imports pygame.
+
+Usage: python -m simulation run --steps 100000 --out observables.npz
+       python -m simulation run --time 2.0 --gamma 2 --T 200 --engine event
+       python -m simulation run --time 2.0 --engine event --dt 1e-3 --spring-dt 1e-4 --backend numba
+       python -m simulation run --steps 100000 --resume state.bin --checkpoint state.bin
+       python -m simulation run --steps 100000 --trajectory run.traj --trajectory-every 10
+       python -m simulation run --steps 100000 --springs 32 --bonds dimers
+       python -m simulation run --time 2.0 --integrator verlet --dt 5e-5 --contact-mode approaching
+       python -m simulation run --steps 10000 --particles 20000 --dtype float32
+       python -m simulation run --steps 10000 --profile
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+import config
+from simulation import Simulation
+from event_simulation import EventSimulation
+from trajectory import TrajectoryRecorder
+from profiling import PhaseStats
+
+# Command-line flags of the demo parameters, keyed by "par4sim" names
+PARAM_FLAGS = {"gamma": "--gamma", "T": "--T", "k": "--k", "m_spring": "--m-spring", "R": "--R", "r": "--particles"}
+
+
+def run(args: argparse.Namespace):
+    loader = config.ConfigLoader()
+    params = loader.initial_sim_params()
+    for name, flag in PARAM_FLAGS.items():
+        value = getattr(args, flag.lstrip("-").replace("-", "_"))
+        if value is not None:
+            params[name] = value
+    params["r"] = int(params["r"])
+
+    engine = EventSimulation if (args.engine or loader['sim_engine']) == "event" else Simulation
+    engine_kwargs = dict(spring_dt=args.spring_dt or loader['sim_spring_dt']) if engine is EventSimulation else {}
+    if args.resume is not None:
+        # The parameters are restored from the checkpoint, the seed forks a new random stream
+        simulation = engine.load(args.resume, seed=args.seed)
+        params = simulation.to_params(loader["R_mass"])
+    else:
+        simulation = engine.from_params(
+            params, l_0=loader['l_0'], R_size=loader["R_size"], R_mass=loader["R_mass"],
+            contact_mode=args.contact_mode or loader['sim_contact_mode'],
+            backend=args.backend or loader['sim_backend'],
+            integrator=args.integrator or loader['sim_integrator'], dt=args.dt or loader['sim_dt'],
+            dtype=args.dtype or loader['sim_dtype'],
+            seed=args.seed, spring_cnt=args.springs,
+            bonds=(Simulation.chain_bonds if args.bonds == "chain" else Simulation.dimer_bonds)(args.springs),
+            **engine_kwargs
+        )
+
+    steps = args.steps if args.time is None else math.ceil(args.time / simulation.dt)
+    records = steps // args.record_every
+    steps = records * args.record_every
+    # Without periodic checkpoints all the steps are advanced by one step_many call
+    block = args.checkpoint_every if args.checkpoint is not None and args.checkpoint_every else max(records, 1)
+
+    if args.trajectory is not None:
+        simulation.recorder = TrajectoryRecorder(args.trajectory, every=args.trajectory_every)
+    if args.profile:
+        simulation.phase_stats = PhaseStats()
+
+    start = time.perf_counter()
+    batches = []
+    for first in range(0, records, block):
+        batches.append(simulation.step_many(min(block, records - first) * args.record_every, args.record_every))
+        if first + block < records:
+            simulation.save(args.checkpoint)
+    elapsed = time.perf_counter() - start
+    if simulation.recorder is not None:
+        simulation.recorder.close()
+    if args.checkpoint is not None:
+        simulation.save(args.checkpoint)
+
+    observables = {name: np.concatenate([getattr(batch, name) for batch in batches] + [np.empty(0)])
+                   for name in ("kinetic", "potential", "force", "full_energy")}
+    observables["time"] = np.arange(1, records + 1) * args.record_every * simulation.dt
+    np.savez(args.out, **observables, params=np.array([params[name] for name in PARAM_FLAGS]),
+             param_names=np.array(list(PARAM_FLAGS)))
+    print(f"{steps} steps in {elapsed:.2f} s ({steps / elapsed:.0f} steps/s), observables saved to {args.out}")
+    print(f"kinetic energy:   {simulation.mean_kinetic_energy():.4f}, expected {simulation.expected_kinetic_energy():.4f}")
+    print(f"potential energy: {simulation.mean_potential_energy():.4f}, "
+          f"expected {simulation.expected_potential_energy():.4f}")
+    if simulation.phase_stats is not None:
+        print(simulation.phase_stats.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m simulation", description="Headless simulation runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the simulation and save the observables")
+    length = run_parser.add_mutually_exclusive_group()
+    length.add_argument("--steps", type=int, default=100_000, help="number of the simulation steps")
+    length.add_argument("--time", type=float, default=None, help="simulated time, overrides --steps")
+    run_parser.add_argument("--record-every", type=int, default=1, help="observables are saved every k steps")
+    run_parser.add_argument("--out", default="observables.npz")
+    run_parser.add_argument("--seed", type=int, default=None)
+    run_parser.add_argument("--resume", default=None, help="checkpoint to start from instead of the config parameters")
+    run_parser.add_argument("--checkpoint", default=None, help="checkpoint saved at the end of the run")
+    run_parser.add_argument("--checkpoint-every", type=int, default=0,
+                            help="the checkpoint is also saved every n records")
+    run_parser.add_argument("--trajectory", default=None, help="file of the recorded positions and velocities")
+    run_parser.add_argument("--trajectory-every", type=int, default=10, help="trajectory is recorded every k steps")
+    run_parser.add_argument("--springs", type=int, default=2, help="number of the spring particles")
+    run_parser.add_argument("--bonds", choices=("dimers", "chain"), default="dimers",
+                            help="the spring particles are split into dimers or connected into one chain")
+    run_parser.add_argument("--engine", choices=("fixed", "event"), default=None,
+                            help="default is sim_engine config record")
+    run_parser.add_argument("--backend", choices=Simulation.BACKENDS, default=None,
+                            help="default is sim_backend config record")
+    run_parser.add_argument("--integrator", choices=Simulation.INTEGRATORS, default=None,
+                            help="default is sim_integrator config record")
+    run_parser.add_argument("--dt", type=float, default=None, help="time step, default is sim_dt config record")
+    run_parser.add_argument("--spring-dt", type=float, default=None,
+                            help="max time between the spring kicks of the event engine, "
+                                 "default is sim_spring_dt config record")
+    run_parser.add_argument("--dtype", choices=tuple(Simulation.DTYPES), default=None,
+                            help="float type of the state, default is sim_dtype config record")
+    run_parser.add_argument("--profile", action="store_true", help="print the time of every phase of the steps")
+    run_parser.add_argument("--contact-mode", choices=Simulation.CONTACT_MODES, default=None,
+                            help="default is sim_contact_mode config record")
+    for name, flag in PARAM_FLAGS.items():
+        run_parser.add_argument(flag, type=float, default=None, help=f"{name}, default is the config initial value")
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,13 @@ class ConfigLoader(object):
     def __getitem__(self, item):
         return self._loader[item]
 
+    def initial_sim_params(self) -> dict:
+        """
+        :return: initial values of the demo parameters keyed by "par4sim" names
+        """
+        return dict(zip(self._loader['par4sim'],
+                        (self._loader['param_initial'][name] for name in self._loader['param_names'])))
+
     def set(self, key: str | tuple, value):
         """
         Change record with key in config.
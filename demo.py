@@ -1,12 +1,28 @@
+from itertools import repeat
+from typing import Optional, Tuple
+
 import pygame
 import numpy as np
 import config
 from simulation import Simulation
+from event_simulation import EventSimulation
+from trajectory import TrajectoryReader
+from sim_thread import SimulationThread
+from sim_server import SimulationServer
 
 
 class Demo:
-    def __init__(self, app, position, demo_size, bg_color, border_color, bg_screen_color, params):
+    # Reads of a snapshot the server has rewritten meanwhile before the previous frame is drawn again
+    SNAPSHOT_RETRIES = 3
+
+    def __init__(self, app, position, demo_size, bg_color, border_color, bg_screen_color, params, seed=None,
+                 runner=None):
+        """
+        :param seed: seed of the simulation, see Simulation
+        :param runner: "inline", "thread" or "process", the "sim_runner" config record by default
+        """
         self.screen = app.screen
+        self.profiler = app.frame_profiler
         self.bg_color = bg_color
         self.bg_screen_color = bg_screen_color
         self.bd_color = border_color
@@ -18,37 +34,74 @@ class Demo:
         self.modified_par = None
         loader = config.ConfigLoader()
 
-        # r_init = np.random.uniform(size=(2, params['r'] + 2))
-        # v_init = np.random.uniform(low=-500, high=500, size=(2, params['r'] + 2))
-        m = np.ones((params['r'] + 2, )) * (loader["R_mass"])
-        m_spring = m[:2] * params['m_spring']
-        m = m[2:]
-        # r, r_spring = r_init[:, 2:], r_init[:, :2]
-        # v, v_spring = v_init[:, 2:], v_init[:, :2]
-        # Размер броуновских частиц
-
-        l_0 = loader['l_0']
-        self.simulation = Simulation(
-            gamma=params['gamma'], k=params['k'], l_0=l_0, R=loader["R_size"], R_spring=loader["R_size"] * params['R'],
-            particles_cnt=params['r'], spring_cnt=2,
-            T = params['T'],
-            m=m, m_spring=m_spring,
+        self._engine = EventSimulation if loader['sim_engine'] == 'event' else Simulation
+        engine_kwargs = dict(spring_dt=loader['sim_spring_dt']) if self._engine is EventSimulation else {}
+        simulation = self._engine.from_params(
+            params, l_0=loader['l_0'], R_size=loader["R_size"], R_mass=loader["R_mass"],
+            contact_mode=loader['sim_contact_mode'], backend=loader['sim_backend'],
+            integrator=loader['sim_integrator'], dt=loader['sim_dt'], dtype=loader['sim_dtype'], seed=seed,
+            **engine_kwargs
         )
+        # Frames of a recorded trajectory are drawn instead of the live simulation
+        self.replay = TrajectoryReader(loader['replay_path']) if loader['replay_path'] else None
+        self.replay_frame = 0
+        self._runner_kind = (runner or loader['sim_runner']) if self.replay is None else 'inline'
+        self._make_runner(simulation)
+        # Pre-rendered circles of the particles, rebuilt when the radii change
+        self._sprites = None
+        self._sprite_radii = None
+
+    def _make_runner(self, simulation: Simulation):
+        """
+        The simulation runs on a worker thread or in a server process, it is started by the first draw
+        """
+        loader = config.ConfigLoader()
+        self._simulation = simulation
+        # State the runner starts from
+        self._start_simulation = simulation
+        if self._runner_kind == 'thread':
+            self.runner = SimulationThread(simulation, frames_c=loader['sim_avg_frames_c'])
+        elif self._runner_kind == 'process':
+            max_particles = loader['param_bounds'][loader['param_names'][loader['par4sim'].index('r')]][1]
+            self.runner = SimulationServer(simulation, capacity=simulation.r_spring.shape[1] + max_particles,
+                                           frames_c=loader['sim_avg_frames_c'])
+            # The server process advances its own copy, the local one stays at the initial state
+            self._simulation = None
+        else:
+            self.runner = None
+        self.runner_started = False
+        # _draw_particles arguments of the last consistent snapshot
+        self._last_positions = None
+
+    @property
+    def simulation(self) -> Simulation:
+        """
+        Simulation advanced by the inline and thread runners, the process runner has no local one
+        """
+        if self._simulation is None:
+            raise RuntimeError("the simulation runs in the server process, it's accessed through the runner")
+        return self._simulation
 
     def set_params(self, params, par):
         loader = config.ConfigLoader()
         if par == 'gamma':
-            self.simulation.set_params(gamma=params['gamma'])
+            kwargs = dict(gamma=params['gamma'])
         elif par == 'k':
-            self.simulation.set_params(k=params['k'])
+            kwargs = dict(k=params['k'])
         elif par == 'R':
-            self.simulation.set_params(R_spring=params['R'] * loader["R_size"])
+            kwargs = dict(R_spring=params['R'] * loader["R_size"])
         elif par == 'T':
-            self.simulation.set_params(T=params['T'])
+            kwargs = dict(T=params['T'])
         elif par == 'r':
-            self.simulation.set_params(particles_cnt=params['r'])
+            kwargs = dict(particles_cnt=params['r'])
         elif par == 'm_spring':
-            self.simulation.set_params(m_spring=params['m_spring'] * loader["R_mass"])
+            kwargs = dict(m_spring=params['m_spring'] * loader["R_mass"])
+        else:
+            return
+        if self.runner is not None:
+            self.runner.set_params(**kwargs)
+        else:
+            self.simulation.set_params(**kwargs)
 
     def draw_check(self, params):
         pygame.draw.rect(self.screen, self.bg_color, self.main)
@@ -64,15 +117,23 @@ class Demo:
 #            self.set_params(params['params'], modified_par)
 #            self.params[modified_par] = params['params'][modified_par]
 
+        if self.replay is not None:
+            self._draw_replay(params)
+            return
+        if self.runner is not None:
+            self._draw_runner(params)
+            return
+
         loader = config.ConfigLoader()
-        new_args = next(self.simulation)
-        for i in range(params['params']['speed']):
-            new_args = next(self.simulation)
-            params['kinetic'][i] = self.simulation.calc_kinetic_energy().item()
-            params['potential'][i] = self.simulation.calc_potential_energy().item()
-            params['mean_kinetic'][i] = self.simulation.mean_kinetic_energy(loader['sim_avg_frames_c'])
-            params['mean_potential'][i] = self.simulation.mean_potential_energy(loader['sim_avg_frames_c'])
-        for i in range(params['params']['speed'], len(params['kinetic'])):
+        speed = params['params']['speed']
+        next(self.simulation)
+        observables = self.simulation.step_many(speed, frames_c=loader['sim_avg_frames_c'])
+        self.profiler.lap("physics")
+        params['kinetic'][:speed] = observables.kinetic.tolist()
+        params['potential'][:speed] = observables.potential.tolist()
+        params['mean_kinetic'][:speed] = observables.mean_kinetic.tolist()
+        params['mean_potential'][:speed] = observables.mean_potential.tolist()
+        for i in range(speed, len(params['kinetic'])):
             params['kinetic'][i] = -1
             params['potential'][i] = -1
             params['mean_kinetic'][i] = -1
@@ -81,23 +142,157 @@ class Demo:
         # params['kinetic'] = self.simulation.calc_kinetic_energy().item()
         # params['potential'] = self.simulation.calc_potential_energy().item()
 
-        r, r_spring = new_args[0].copy(), new_args[1].copy()
-        r_radius = self.size * self.simulation.R
-        r_spring_radius = self.size * self.simulation.R_spring
-        r[0], r_spring[0] = self.pos_start[0] + r[0] * self.size, self.pos_start[0] + r_spring[0] * self.size
-        r[1], r_spring[1] = self.pos_start[1] - r[1] * self.size, self.pos_start[1] - r_spring[1] * self.size
-        r, r_spring, r_radius, r_spring_radius = np.round(r), np.round(r_spring), np.round(r_radius), np.round(r_spring_radius)
-        for i in range(r.shape[1]):
-            pygame.draw.circle(self.screen, (19, 88, 145), tuple(r[:, i]), r_radius)
-        for i in range(r_spring.shape[1]):
-            pygame.draw.circle(self.screen, (0, 0, 0), tuple(r_spring[:, i]), r_spring_radius)
-
-        # draw spring
-        pygame.draw.line(self.screen, (0, 0, 0), tuple(r_spring[:, 0]), tuple(r_spring[:, 1]), width=2)
-        # draw border
+        self._draw_particles(self.simulation.r, self.simulation.r_spring, self.simulation.R, self.simulation.R_spring,
+                             self.simulation.bonds)
+        self.profiler.lap("particles")
+
+    def _draw_replay(self, params):
+        frames_c = config.ConfigLoader()['sim_avg_frames_c']
+        speed = params['params']['speed']
+        for i in range(speed):
+            frame_no = min(self.replay_frame + i, len(self.replay) - 1)
+            frame = self.replay[frame_no]
+            params['kinetic'][i] = frame.kinetic
+            params['potential'][i] = frame.potential
+            params['mean_kinetic'][i], params['mean_potential'][i] = self.replay.mean_energies(frame_no, frames_c)
+        for i in range(speed, len(params['kinetic'])):
+            params['kinetic'][i] = -1
+            params['potential'][i] = -1
+            params['mean_kinetic'][i] = -1
+            params['mean_potential'][i] = -1
+        self.seek(speed)
+        self.profiler.lap("replay")
+
+        frame = self.replay[self.replay_frame]
+        self._draw_particles(frame.r[:, frame.n_spring:], frame.r[:, :frame.n_spring], frame.R, frame.R_spring,
+                             frame.bonds)
+        self.profiler.lap("particles")
+
+    def close(self):
+        """
+        Stops the worker thread or the server process of the simulation
+        """
+        if self.runner is not None:
+            self.runner.stop()
+            self.runner_started = False
+
+    def get_state(self) -> Optional[Tuple[dict, dict]]:
+        """
+        :return: scalars and arrays of the simulation state (see Simulation._get_state), None while a trajectory
+        is replayed
+        """
+        if self.replay is not None:
+            return None
+        if self.runner is not None and self.runner_started:
+            return self.runner.get_state()
+        return self._start_simulation._get_state()
+
+    def set_state(self, scalars: dict, arrays: dict):
+        """
+        Continues the simulation from the get_state() of another demo, e.g. of the one before the language switch
+        """
+        simulation = self._engine.__new__(self._engine)
+        simulation._set_state(scalars, arrays)
+        self.close()
+        self._make_runner(simulation)
+
+    def expected_kinetic_energy(self) -> float:
+        return (self.runner or self._simulation).expected_kinetic_energy()
+
+    def expected_potential_energy(self) -> float:
+        return (self.runner or self._simulation).expected_potential_energy()
+
+    def _draw_runner(self, params):
+        if not self.runner_started:
+            self.runner.start()
+            self.runner_started = True
+        # speed is the number of the steps between two published snapshots
+        self.runner.block = params['params']['speed']
+        observables = self.runner.take_observables()
+        # All the steps done since the previous frame are passed to the charts, -1 ends the records
+        for name in ('kinetic', 'potential', 'mean_kinetic', 'mean_potential'):
+            params[name][:] = getattr(observables, name).tolist() + [-1]
+        self.profiler.lap("physics")
+
+        positions = self._read_snapshot()
+        if positions is None:
+            return
+        self._draw_particles(*positions)
+        self.profiler.lap("particles")
+
+    def _read_snapshot(self):
+        """
+        :return: _draw_particles arguments copied from the published snapshot, the previous ones if it has been
+        rewritten during every read, None if nothing is published yet
+        """
+        for _ in range(self.SNAPSHOT_RETRIES):
+            snapshot = self.runner.acquire()
+            if snapshot is None:
+                break
+            try:
+                positions = (snapshot.r_particles.copy(), snapshot.r_spring.copy(), snapshot.R, snapshot.R_spring,
+                             snapshot.bonds.copy())
+            finally:
+                # SimulationThread keeps the acquired snapshot until the release and returns None
+                consistent = self.runner.release() is not False
+            if consistent:
+                self._last_positions = positions
+                break
+        return self._last_positions
+
+    def seek(self, frames: int):
+        """
+        Moves the replay position by frames, it is clamped to the recorded range
+        """
+        if self.replay is not None:
+            self.replay_frame = min(max(self.replay_frame + frames, 0), len(self.replay) - 1)
+
+    def _get_sprites(self, r_radius: int, r_spring_radius: int):
+        """
+        :return: circle sprites of the particles and of the spring particles, cached until the radii change
+        """
+        if self._sprite_radii != (r_radius, r_spring_radius):
+            self._sprites = self._make_sprite(r_radius, (19, 88, 145)), self._make_sprite(r_spring_radius, (0, 0, 0))
+            self._sprite_radii = r_radius, r_spring_radius
+        return self._sprites
+
+    def _make_sprite(self, radius: int, color) -> pygame.Surface:
+        sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1))
+        key = (255, 0, 255) if color != (255, 0, 255) else (0, 255, 0)
+        sprite.fill(key)
+        pygame.draw.circle(sprite, color, (radius, radius), radius)
+        sprite.set_colorkey(key, pygame.RLEACCEL)
+        return sprite.convert(self.screen)
+
+    def _blit_sprites(self, sprite: pygame.Surface, corners):
+        # fblits of pygame-ce skips the per-blit bookkeeping of blits
+        if hasattr(self.screen, 'fblits'):
+            self.screen.fblits(zip(repeat(sprite), corners))
+        else:
+            self.screen.blits(zip(repeat(sprite), corners), doreturn=False)
+
+    def _draw_particles(self, r, r_spring, R, R_spring, bonds):
+        r_radius = int(np.round(self.size * R))
+        r_spring_radius = int(np.round(self.size * R_spring))
+        sprite, spring_sprite = self._get_sprites(r_radius, r_spring_radius)
+        # The particles crossing the walls are cut by the box
+        self.screen.set_clip(self.main)
+        origin = np.array([[self.pos_start[0]], [self.pos_start[1]]])
+        scale = np.array([[self.size], [-self.size]])
+        r = np.round(origin + r * scale).astype(int)
+        r_spring = np.round(origin + r_spring * scale).astype(int)
+        # Top-left corners of the sprites
+        self._blit_sprites(sprite, (r - r_radius).T.tolist())
+        self._blit_sprites(spring_sprite, (r_spring - r_spring_radius).T.tolist())
+        r_spring = r_spring.T.tolist()
+
+        # draw springs
+        for i, j in bonds:
+            pygame.draw.line(self.screen, (0, 0, 0), r_spring[i], r_spring[j], width=2)
+        self.screen.set_clip(None)
+
+    def draw_border(self):
         inner_border = 3
-        mask_border = 50
-        pygame.draw.rect(self.screen, self.bg_screen_color, (self.position[0] - mask_border, self.position[1] - mask_border, self.size + mask_border * 2, self.size + mask_border * 2), mask_border)
         pygame.draw.rect(self.screen, self.bd_color, (
         self.position[0] - inner_border, self.position[1] - inner_border, self.size + inner_border * 2,
         self.size + inner_border * 2), inner_border)
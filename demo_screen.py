@@ -1,6 +1,7 @@
 import pygame
 
 import language
+from text_cache import TextCache
 from button import Button
 from slider import *
 from demo import Demo
@@ -10,16 +11,23 @@ import config
 
 
 class DemoScreen:
-    def __init__(self, app):
+    # Frames skipped by one arrow key press in the replay mode
+    REPLAY_SEEK = 100
+
+    def __init__(self, app, seed=None, runner=None):
+        """
+        :param seed: seed of the demo simulation
+        :param runner: runner of the demo simulation, the "sim_runner" config record by default
+        """
         lang = language.Language()
         self.app = app
         self.screen = app.screen
         self.speed = 0.5
         self.bg_color = (210, 210, 210)
         self.font = 'corbel'
-        self.little_font = pygame.font.SysFont(self.font, 35)
-        self.middle_font = pygame.font.SysFont(self.font, 40, bold=True)
-        self.big_font = pygame.font.SysFont(self.font, 50)
+        self.little_font = TextCache().font(self.font, 35)
+        self.middle_font = TextCache().font(self.font, 40, bold=True)
+        self.big_font = TextCache().font(self.font, 50)
 
         self.buttons = [Button(app, lang['btn_apply'], (app.monitor.width * 0.05 + 30, app.monitor.width * 0.43 + 60), (250, 80), self.apply),
                         Button(app, lang['btn_mode'], (app.monitor.width * 0.05 + 30 + 290, app.monitor.width * 0.43 + 60), (250, 80), self.modes),
@@ -41,7 +49,7 @@ class DemoScreen:
         ]
 
         self.demo = Demo(app, (app.monitor.width * 0.05 + 30, 30), (app.monitor.width * 0.43, app.monitor.width * 0.43), (255, 255, 255), (100, 100, 100), self.bg_color,
-                         {name: sl.getValue() for name, sl in zip(par4sim, self.sliders)})
+                         {name: sl.getValue() for name, sl in zip(par4sim, self.sliders)}, seed=seed, runner=runner)
 
         self.demo_config = {'params': {name: sl.getValue() for name, sl in zip(par4sim, self.sliders)},
                             'kinetic': [0] * param_bounds[-1][1],
@@ -52,18 +60,26 @@ class DemoScreen:
         print(self.demo_config)
         buf_len = config.ConfigLoader()['buf_len']
         self.graphics = [Chart(self.app, 'mean_kinetic', lang['graph_mean'] + ' ' + lang['graph_kin'], (app.monitor.width * 0.5 + 50, app.monitor.height * 0.31 + 20), (800, 310), (100, 100, 100),
-                               len_buf=buf_len, const_legend='kT', const_func=self.demo.simulation.expected_kinetic_energy),
+                               len_buf=buf_len, const_legend='kT', const_func=self.demo.expected_kinetic_energy),
                          Chart(self.app, 'mean_potential', lang['graph_mean'] + ' ' + lang['graph_pot'], (app.monitor.width * 0.5 + 50,  app.monitor.height * 0.31 + 20 + 310 + 10), (800, 310), (100, 100, 100),
-                               len_buf=buf_len, const_legend='kT/(γ+1)', const_func=self.demo.simulation.expected_potential_energy),
+                               len_buf=buf_len, const_legend='kT/(γ+1)', const_func=self.demo.expected_potential_energy),
                          Chart(self.app, 'kinetic', lang['graph_kin'], (app.monitor.width * 0.5 + 50, app.monitor.height * 0.31 + 20), (800, 310), (100, 100, 100),
-                               len_buf=buf_len, const_legend='kT', const_func=self.demo.simulation.expected_kinetic_energy),
+                               len_buf=buf_len, const_legend='kT', const_func=self.demo.expected_kinetic_energy),
                          Chart(self.app, 'potential', lang['graph_pot'], (app.monitor.width * 0.5 + 50,  app.monitor.height * 0.31 + 20 + 310 + 10), (800, 310), (100, 100, 100),
-                               len_buf=buf_len, const_legend='kT/(γ+1)', const_func=self.demo.simulation.expected_potential_energy)]
+                               len_buf=buf_len, const_legend='kT/(γ+1)', const_func=self.demo.expected_potential_energy)]
 
         self.slider_grabbed = False
 
         self.charts_mode = True
 
+        # Static layer: the screen fill, the demo border, the buttons and the slider names. None means
+        # the whole screen is redrawn by the next frame
+        self._background = None
+        # Areas drawn over the layers by the others (the profiler overlay), restored by the next frame
+        self._invalid = []
+        self._slider_states = [None] * len(self.sliders)
+        self._charts_dirty = True
+
     def correct_limits(self):
         if self.charts_mode:
             self.graphics[0].set_ylim(self.graphics[2].get_ylim())  # mean_kinetic.y_lim = kinetic.y_lim
@@ -78,9 +94,31 @@ class DemoScreen:
         self.demo._refresh_iter(self.demo_config)
         self.demo_config['is_changed'] = False
 
+    def close(self):
+        self.demo.close()
+
+    def get_state(self) -> dict:
+        """
+        :return: slider positions, applied parameters and simulation state of the screen, see set_state()
+        """
+        return dict(sliders=[sl.slider.button_rect.centerx for sl in self.sliders], params=dict(self.demo.params),
+                    simulation=self.demo.get_state())
+
+    def set_state(self, state: dict):
+        """
+        Continues from the get_state() of the screen before the rebuild
+        """
+        for sl, centerx in zip(self.sliders, state['sliders']):
+            sl.slider.button_rect.centerx = centerx
+        self.demo_config['params'] = {sl.name_par: sl.getValue() for sl in self.sliders}
+        self.demo.params.update(state['params'])
+        if state['simulation'] is not None:
+            self.demo.set_state(*state['simulation'])
+
     def modes(self):
         self.graphics[2:], self.graphics[:2] = self.graphics[:2], self.graphics[2:]
         self.charts_mode = not self.charts_mode
+        self._charts_dirty = True
 
     def to_menu(self):
         self.app.active_screen = self.app.menu_screen
@@ -103,14 +141,61 @@ class DemoScreen:
 
         return param_names, sliders_gap, param_poses, param_bounds, param_initial, param_step, par4sim, dec_numbers
 
-    def _update_screen(self):
+    def invalidate(self, rect=None):
+        """
+        Restores the rect from the static layer by the next frame, the whole screen is redrawn if rect is None
+        """
+        if rect is None:
+            self._background = None
+        else:
+            self._invalid.append(pygame.Rect(rect))
+
+    def _render_background(self):
         self.screen.fill(self.bg_color)
-        self.demo.draw_check(self.demo_config)
+        self.demo.draw_border()
         for button in self.buttons:
             button.draw_button()
         for slider in self.sliders:
-            slider.draw_check(self.demo_config['params'])
-        self._draw_figures()
+            slider.par_name.draw_button()
+        self._background = self.screen.copy()
+        self._invalid = []
+        self._slider_states = [None] * len(self.sliders)
+        self._charts_dirty = True
+
+    def _update_screen(self):
+        """
+        Redraws the changed layers over the static one
+        :return: changed areas of the screen
+        """
+        profiler = self.app.frame_profiler
+        if self._background is None:
+            self._render_background()
+            dirty = [self.screen.get_rect()]
+        else:
+            for rect in self._invalid:
+                self.screen.blit(self._background, rect, rect)
+            dirty, self._invalid = self._invalid, []
+            # The layers under the restored areas are redrawn
+            for i, slider in enumerate(self.sliders):
+                if slider.rect.collidelist(dirty) != -1:
+                    self._slider_states[i] = None
+            if any(fig.border.collidelist(dirty) != -1 for fig in self.graphics):
+                self._charts_dirty = True
+        profiler.lap("clear")
+        self.demo.draw_check(self.demo_config)
+        dirty.append(self.demo.main)
+        for i, slider in enumerate(self.sliders):
+            state = slider.slider.button_rect.centerx, slider.slider.hovered
+            if state != self._slider_states[i]:
+                rect = slider.rect
+                self.screen.blit(self._background, rect, rect)
+                slider.draw_check(self.demo_config['params'])
+                dirty.append(rect.union(slider.rect))
+                self._slider_states[i] = state
+        profiler.lap("sliders")
+        dirty += self._draw_figures()
+        profiler.lap("charts")
+        return dirty
 
     def _check_events(self):
         events = pygame.event.get()
@@ -120,12 +205,30 @@ class DemoScreen:
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_position = pygame.mouse.get_pos()
                 self._check_buttons(mouse_position)
+            elif event.type == pygame.KEYDOWN:
+                self._check_keys(event)
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.invalidate()
 
             mouse_pos = pygame.mouse.get_pos()
             mouse = pygame.mouse.get_pressed()
             self._check_sliders(mouse_pos, mouse)
         # pygame_widgets.update(events)
 
+    def _check_keys(self, event):
+        # Seeking of the replayed trajectory, shift makes the step ten times longer
+        step = self.REPLAY_SEEK * (10 if event.mod & pygame.KMOD_SHIFT else 1)
+        if event.key == pygame.K_LEFT:
+            self.demo.seek(-step)
+        elif event.key == pygame.K_RIGHT:
+            self.demo.seek(step)
+        elif event.key == pygame.K_HOME:
+            self.demo.seek(-self.demo.replay_frame)
+        elif event.key == pygame.K_F3:
+            self.app.frame_profiler.toggle()
+        elif event.key == pygame.K_F4:
+            self.app.frame_profiler.export_trace(config.ConfigLoader()['trace_path'])
+
     def _check_sliders(self, mouse_position, mouse_pressed):
         for slider in self.sliders:
             if slider.slider.button_rect.collidepoint(mouse_position):
@@ -149,12 +252,24 @@ class DemoScreen:
                 button.command()
 
     def _draw_figures(self):
-        for fig in self.graphics:
-            fig.draw(self.demo_config)
+        """
+        :return: areas of the redrawn charts
+        """
+        changed = [fig.update(self.demo_config) for fig in self.graphics]
+        rects = []
+        if any(changed) or self._charts_dirty:
+            # The last two charts cover the first ones, which are drawn for the limits of correct_limits
+            rects = [fig.border for fig in self.graphics[2:]]
+            for rect in rects:
+                self.screen.blit(self._background, rect, rect)
+            for fig in self.graphics:
+                fig.render()
+            self._charts_dirty = False
 
         self.correct_limits()
         # Part of refreshing charts feature.
 #        self.demo_config['is_changed'] = False
+        return rects
 
 
 def _init_val_into_unit(initial_val, bounds) -> float:
@@ -0,0 +1,336 @@
+import numpy as np
+from numpy import ndarray
+from typing import Tuple, Union
+from scipy import stats
+from simulation import Simulation
+from accumulators import RunningStats
+
+
+class SimulationEnsemble:
+    """
+    M independent replicas of Simulation advanced together, one set of array operations per step.
+    The state is stored as (2, M, N) arrays, so r, v, ... are (M, 2, N) views of it
+    and the broad phase runs once over all the replicas.
+    """
+    # Max number of the last frames the energies can be averaged over
+    ENERGY_WINDOW = 2 ** 12
+
+    def __init__(self, replicas_cnt: int,
+                 gamma: float, k: float, l_0: float, R: float, R_spring: float,
+                 particles_cnt: int, spring_cnt: int,
+                 T: float,
+                 m: ndarray, m_spring: ndarray,
+                 contact_mode: str = "available",
+                 seed: Union[int, np.random.SeedSequence, None] = None,
+                 bonds: ndarray = None, dtype: str = "float64"):
+        """
+        :param bonds: bonds of the spring particles of every replica, see Simulation
+        :param dtype: float type of the state, see Simulation. "float32" halves the memory of the replicas
+        """
+        if replicas_cnt <= 0:
+            raise ValueError("replicas_cnt must be > 0")
+        if contact_mode not in Simulation.CONTACT_MODES:
+            raise ValueError(f"contact_mode must be one of {Simulation.CONTACT_MODES}")
+        if dtype not in Simulation.DTYPES:
+            raise ValueError(f"dtype must be one of {tuple(Simulation.DTYPES)}")
+        self._dtype = np.dtype(dtype)
+        self._index_dtype = np.dtype(Simulation.DTYPES[dtype])
+        self._bonds = Simulation._check_bonds(Simulation.dimer_bonds(spring_cnt) if bonds is None else bonds,
+                                              spring_cnt)
+        self._rng = np.random.default_rng(seed)
+        self._k_boltz = 1.380 * 1e-2
+        self._gamma = gamma
+        self._k = k
+        self._l_0 = l_0
+        self._R = R
+        self._R_spring = R_spring
+        self._contact_mode = contact_mode
+        self._n_replicas = replicas_cnt
+        self._n_particles = particles_cnt
+        self._n_spring = spring_cnt
+        n = spring_cnt + particles_cnt
+
+        self._r = np.empty((2, replicas_cnt, n), dtype=self._dtype)
+        for i in range(replicas_cnt):
+            self._r[:, i, :spring_cnt] = Simulation._sample_r_sping(spring_cnt, k, self._k_boltz, l_0, gamma, T,
+                                                                       self._rng, self._bonds)
+        self._r[:, :, spring_cnt:] = self._rng.uniform(size=(2, replicas_cnt, particles_cnt))
+        self._m = np.hstack([m_spring, m], dtype=self._dtype)
+        self._v = stats.norm.rvs(loc=0.0, scale=np.sqrt(self._k_boltz * T / self._m), size=(2, replicas_cnt, n),
+                                 random_state=self._rng).astype(self._dtype, copy=False)
+
+        groups = np.arange(replicas_cnt)
+        self._groups_spring = np.repeat(groups, spring_cnt)
+        self._groups_particles = np.repeat(groups, particles_cnt)
+        self._last_ic = np.zeros((0, 2), dtype=self._index_dtype)
+
+        self._potential_energy = RunningStats(self.ENERGY_WINDOW, (replicas_cnt, ))
+        self._kinetic_energy = RunningStats(self.ENERGY_WINDOW, (replicas_cnt, ))
+
+        self._E_full = self.calc_full_energy()
+        self._T_tar = float(np.mean(self.T))
+        self._dt = 0.00001
+        self._frame_no = 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Tuple[ndarray, ndarray, ndarray, ndarray, ndarray]:
+        f = self.motion(dt=self._dt)
+        self._frame_no = (self._frame_no + 1) % 5
+
+        self._potential_energy.push(self.calc_potential_energy())
+        self._kinetic_energy.push(self.calc_kinetic_energy())
+
+        if self._frame_no == 0:
+            self._fix_energy()
+
+        return self.r, self.r_spring, self.v, self.v_spring, f
+
+    @property
+    def replicas_cnt(self) -> int:
+        return self._n_replicas
+
+    @property
+    def dtype(self) -> str:
+        return self._dtype.name
+
+    @property
+    def T(self) -> ndarray:
+        """
+        :return: temperature of every replica
+        """
+        return np.mean((np.sum(self._v ** 2, axis=0) * self._m), axis=1, dtype=float) / (2 * self._k_boltz)
+
+    @property
+    def gamma(self) -> float:
+        return self._gamma
+
+    @property
+    def k(self) -> float:
+        return self._k
+
+    @property
+    def l_0(self) -> float:
+        return self._l_0
+
+    @property
+    def R(self) -> float:
+        return self._R
+
+    @property
+    def R_spring(self) -> float:
+        return self._R_spring
+
+    @property
+    def contact_mode(self) -> str:
+        return self._contact_mode
+
+    @property
+    def r(self) -> ndarray:
+        return self._r[:, :, self._n_spring:].transpose(1, 0, 2)
+
+    @property
+    def r_spring(self) -> ndarray:
+        return self._r[:, :, :self._n_spring].transpose(1, 0, 2)
+
+    @property
+    def v(self) -> ndarray:
+        return self._v[:, :, self._n_spring:].transpose(1, 0, 2)
+
+    @property
+    def v_spring(self) -> ndarray:
+        return self._v[:, :, :self._n_spring].transpose(1, 0, 2)
+
+    @property
+    def m(self) -> ndarray:
+        return self._m[self._n_spring:]
+
+    @property
+    def m_spring(self) -> ndarray:
+        return self._m[:self._n_spring]
+
+    def _spring_force(self) -> Tuple[ndarray, ndarray]:
+        """
+        :return: forces acting on the first particles of the bonds (with minus sign) and the vectors between
+        the bonded particles, both of shape (2, M, B)
+        """
+        dr = self._r[:, :, self._bonds[:, 0]] - self._r[:, :, self._bonds[:, 1]]
+        dr_sc = np.linalg.norm(dr, axis=0)
+        dx = dr * (1 - self.l_0 / dr_sc)
+        dx_norm = np.abs(dr_sc - self.l_0)
+        f = (self._k * (dx_norm ** (self._gamma - 1))) * dx
+        return f, dr
+
+    def _find_contacts(self) -> ndarray:
+        """
+        :return: pairs of flat ids (replica * N + i) of particles in contact, for every replica the pairs
+        are in the same order as in Simulation.motion
+        """
+        n = self._r.shape[2]
+        ns = self._n_spring
+        r_spring = self._r[:, :, :ns].reshape(2, -1)
+        r = self._r[:, :, ns:].reshape(2, -1)
+
+        def to_flat(ids, n_group, offset):
+            return (ids // n_group) * n + ids % n_group + offset
+
+        idx = self._index_dtype
+        ic_spring = Simulation.get_contact_pairs(r_spring, r_spring, 2 * self.R_spring, same=True,
+                                                 groups_a=self._groups_spring, index_dtype=idx)
+        ic_spring = to_flat(ic_spring, ns, 0)
+        ic_particles = Simulation.get_contact_pairs(r, r, 2 * self.R, same=True, groups_a=self._groups_particles,
+                                                    index_dtype=idx)
+        ic_particles = to_flat(ic_particles, self._n_particles, ns)
+        ic_spring_particles = Simulation.get_contact_pairs(r_spring, r, self.R + self.R_spring,
+                                                           groups_a=self._groups_spring,
+                                                           groups_b=self._groups_particles, index_dtype=idx)
+        ic_spring_particles[:, 0] = to_flat(ic_spring_particles[:, 0], ns, 0)
+        ic_spring_particles[:, 1] = to_flat(ic_spring_particles[:, 1], self._n_particles, ns)
+
+        return np.vstack([ic_spring, ic_particles, ic_spring_particles])
+
+    def motion(self, dt) -> ndarray:
+        r = self._r.reshape(2, -1)
+        v = self._v.reshape(2, -1)
+        m = np.tile(self._m, self._n_replicas)
+
+        ic = self._find_contacts()
+        if self._contact_mode == "approaching":
+            dr = r[:, ic[:, 0]] - r[:, ic[:, 1]]
+            dv = v[:, ic[:, 0]] - v[:, ic[:, 1]]
+            ic = ic[np.sum(dv * dr, axis=0) < 0]
+        else:
+            ic = Simulation._exclude_pairs(ic, self._last_ic, r.shape[1])
+            self._last_ic = ic
+
+        single, rounds = Simulation._collision_rounds(ic, r.shape[1])
+        for k, pairs in enumerate([single] + rounds):
+            if k > 0 and self._contact_mode == "approaching":
+                # The earlier collisions may have turned the pair apart
+                dr = r[:, pairs[:, 0]] - r[:, pairs[:, 1]]
+                dv = v[:, pairs[:, 0]] - v[:, pairs[:, 1]]
+                pairs = pairs[np.sum(dv * dr, axis=0) < 0]
+            v[:, pairs[:, 0]], v[:, pairs[:, 1]] = Simulation.compute_new_v(
+                v[:, pairs[:, 0]], v[:, pairs[:, 1]],
+                r[:, pairs[:, 0]], r[:, pairs[:, 1]],
+                m[pairs[:, 0]], m[pairs[:, 1]]
+            )
+
+        f, dr = self._spring_force()
+        i, j = self._bonds[:, 0], self._bonds[:, 1]
+        np.subtract.at(self._v, (slice(None), slice(None), i), f * (dt / self._m[i]))
+        np.add.at(self._v, (slice(None), slice(None), j), f * (dt / self._m[j]))
+
+        v[0, r[0] > 1] = -np.abs(v[0, r[0] > 1])
+        v[0, r[0] < 0] = np.abs(v[0, r[0] < 0])
+        v[1, r[1] > 1] = -np.abs(v[1, r[1] > 1])
+        v[1, r[1] < 0] = np.abs(v[1, r[1] < 0])
+
+        self._r += self._v * dt
+
+        return np.sum(f * dr, axis=(0, 2))
+
+    def set_params(self,
+                   gamma: float = None, k: float = None, l_0: float = None,
+                   R: float = None, R_spring: float = None, T: float = None,
+                   m: float = None, m_spring: float = None):
+        if gamma is not None:
+            self._gamma = gamma
+        if k is not None:
+            self._k = k
+        if l_0 is not None:
+            self._l_0 = l_0
+        if R is not None:
+            self._R = R
+        if R_spring is not None:
+            self._R_spring = R_spring
+        if T is not None:
+            if T <= 0:
+                raise ValueError("T  must be > 0")
+            self._v *= np.sqrt(T / self._T_tar)
+        if m is not None:
+            if m <= 0:
+                raise ValueError("m_scale must be > 0")
+            self._m[self._n_spring:] = m
+        if m_spring is not None:
+            if m_spring <= 0:
+                raise ValueError("m_spring_scale must be > 0")
+            self._m[0:self._n_spring] = m_spring
+
+        self._E_full = self.calc_full_energy()
+        self._T_tar = float(np.mean(self.T))
+
+    def expected_potential_energy(self) -> float:
+        return float((self._k_boltz * self._T_tar) / (self.gamma + 1))
+
+    def expected_kinetic_energy(self) -> float:
+        return float(self._k_boltz * self._T_tar)
+
+    def calc_kinetic_energy(self) -> ndarray:
+        """
+        :return: mean kinetic energy of the spring particles of every replica
+        """
+        return np.mean(np.sum(self._v[:, :, :self._n_spring] ** 2, axis=0) * self.m_spring, axis=1, dtype=float) / 2
+
+    def calc_full_kinetic_energy(self) -> ndarray:
+        return np.sum(np.sum(self._v ** 2, axis=0) * self._m, axis=1, dtype=float) / 2
+
+    def _bond_energies(self) -> ndarray:
+        dr_sc = np.linalg.norm(self._r[:, :, self._bonds[:, 0]] - self._r[:, :, self._bonds[:, 1]], axis=0)
+        dx_norm = np.abs(dr_sc - self.l_0)
+        return self._k * (dx_norm ** (self._gamma + 1)) / (self._gamma + 1)
+
+    def calc_potential_energy(self) -> ndarray:
+        """
+        :return: potential energy of one spring averaged over the bonds of every replica
+        """
+        return np.mean(self._bond_energies(), axis=1, dtype=float)
+
+    def calc_full_potential_energy(self) -> ndarray:
+        return np.sum(self._bond_energies(), axis=1, dtype=float)
+
+    def calc_full_energy(self) -> ndarray:
+        return self.calc_full_kinetic_energy() + 2 * self.calc_full_potential_energy()
+
+    def _fix_energy(self) -> ndarray:
+        E_par = np.sum(np.sum(self._v[:, :, self._n_spring:] ** 2, axis=0) * self.m, axis=1, dtype=float) / 2
+        beta = (self._E_full - 2 * self.calc_full_potential_energy()
+                - self._n_spring * self.calc_kinetic_energy()) / E_par
+        scale = np.sqrt(beta)
+        self._v[:, :, self._n_spring:] *= scale[None, :, None]
+        return scale
+
+    def mean_potential_energy(self, frames_c: Union[int, None] = None) -> ndarray:
+        """
+        :param frames_c: if frames_c is None then the averaging is taken over all frames,
+        otherwise the averaging is taken over the last frame_c frames, frames_c <= ENERGY_WINDOW
+        :return: mean potential energy of every replica
+        """
+        return self._potential_energy.mean(frames_c)
+
+    def mean_kinetic_energy(self, frames_c: Union[int, None] = None) -> ndarray:
+        """
+        :param frames_c: if frames_c is None then the averaging is taken over all frames,
+        otherwise the averaging is taken over the last frame_c frames, frames_c <= ENERGY_WINDOW
+        :return: mean kinetic energy of every replica
+        """
+        return self._kinetic_energy.mean(frames_c)
+
+    def ensemble_potential_energy(self, frames_c: Union[int, None] = None) -> Tuple[float, float]:
+        """
+        :return: potential energy averaged over the replicas and its standard error
+        """
+        return _mean_and_error(self.mean_potential_energy(frames_c))
+
+    def ensemble_kinetic_energy(self, frames_c: Union[int, None] = None) -> Tuple[float, float]:
+        """
+        :return: kinetic energy averaged over the replicas and its standard error
+        """
+        return _mean_and_error(self.mean_kinetic_energy(frames_c))
+
+
+def _mean_and_error(values: ndarray) -> Tuple[float, float]:
+    if values.shape[0] < 2:
+        return float(np.mean(values)), float('nan')
+    return float(np.mean(values)), float(np.std(values, ddof=1) / np.sqrt(values.shape[0]))
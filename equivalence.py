@@ -0,0 +1,174 @@
+"""
+Equivalence checks of the optimized code paths against their straightforward references, it never imports pygame.
+
+pairs: pairs of Simulation.get_contact_pairs (cell-list broad phase) against the brute-force pair search
+on random configurations with fixed seeds, the zero cutoff and the replica groups included.
+backends: positions and velocities of Simulation(backend="numba") against the numpy backend after the same
+steps from the same seed. The float64 states must be equal bit for bit. The float32 kernels of Numba round
+some intermediates in float64, the trajectories are chaotic, so the float32 states are compared after one step
+within FLOAT32_ULPS of the largest value.
+energy: the collisions of a particle with several partners in one step must conserve the momentum and the kinetic
+energy in every backend, and the "verlet" integrator with the "approaching" mode must keep the temperature within
+ENERGY_DRIFT without the velocity rescaling (fix_energy=False) after the given steps of ENERGY_DT.
+
+Usage: python equivalence.py pairs
+       python equivalence.py backends --steps 2000
+       python equivalence.py energy --steps 2000
+"""
+import argparse
+import sys
+
+import itertools
+
+import numpy as np
+from numpy import ndarray
+
+from benchmark import make_simulation
+from simulation import Simulation
+
+# Allowed difference of the float32 backends after one step, in float32 epsilons of the largest value
+FLOAT32_ULPS = 4
+# Allowed relative change of the temperature without the velocity rescaling and the time step of that check
+ENERGY_DRIFT = 0.03
+ENERGY_DT = 5e-5
+
+
+def brute_force_pairs(r_a: ndarray, r_b: ndarray, cutoff: float, same: bool = False,
+                      groups_a: ndarray = None, groups_b: ndarray = None) -> ndarray:
+    """
+    :return: pairs (i, j) with distance < cutoff found by checking all of them, sorted lexicographically
+    """
+    d2 = (r_a[0][:, None] - r_b[0][None, :]) ** 2 + (r_a[1][:, None] - r_b[1][None, :]) ** 2
+    close = d2 < cutoff ** 2
+    if same:
+        close = np.triu(close, 1)
+        groups_b = groups_a
+    if groups_a is not None:
+        close &= groups_a[:, None] == groups_b[None, :]
+    return np.argwhere(close)
+
+
+def check_pairs(seeds: int) -> int:
+    """
+    :return: number of the mismatched cases
+    """
+    failures = 0
+    for seed in range(seeds):
+        rng = np.random.default_rng(seed)
+        for n, cutoff in ((1, 0.02), (50, 0.0), (200, 0.02), (500, 0.01), (300, 0.3), (100, 2.0)):
+            r_a, r_b = rng.random((2, n)), rng.random((2, n // 2 + 1))
+            groups_a, groups_b = rng.integers(0, 3, n), rng.integers(0, 3, n // 2 + 1)
+            cases = dict(same=(r_a, r_a, dict(same=True)),
+                         cross=(r_a, r_b, {}),
+                         same_groups=(r_a, r_a, dict(same=True, groups_a=groups_a)),
+                         cross_groups=(r_a, r_b, dict(groups_a=groups_a, groups_b=groups_b)))
+            for name, (a, b, kwargs) in cases.items():
+                expected = brute_force_pairs(a, b, cutoff, **kwargs)
+                for index_dtype in (np.intp, np.int32):
+                    found = Simulation.get_contact_pairs(a, b, cutoff, index_dtype=index_dtype, **kwargs)
+                    if not np.array_equal(found, expected):
+                        failures += 1
+                        print(f"pairs mismatch: seed={seed} n={n} cutoff={cutoff} case={name} "
+                              f"index_dtype={np.dtype(index_dtype).name}: {len(found)} found, {len(expected)} expected")
+    return failures
+
+
+def check_backends(seeds: int, steps: int) -> int:
+    """
+    :return: number of the mismatched cases
+    """
+    failures = 0
+    for seed, gamma, integrator, contact_mode, dtype in itertools.product(
+            range(seeds), (1.0, 2.0), Simulation.INTEGRATORS, Simulation.CONTACT_MODES, tuple(Simulation.DTYPES)):
+        states = []
+        for backend in ("numpy", "numba"):
+            simulation = make_simulation(150, 0.01, 0.025, gamma, seed, backend=backend, integrator=integrator,
+                                         contact_mode=contact_mode, dtype=dtype)
+            simulation.step_many(steps if dtype == "float64" else 1)
+            states.append((simulation._r, simulation._v, simulation._last_ic.dtype))
+        (r, v, ic_dtype), (r_numba, v_numba, ic_dtype_numba) = states
+        if dtype == "float64":
+            equal = np.array_equal(r, r_numba) and np.array_equal(v, v_numba)
+        else:
+            eps = np.finfo(np.float32).eps
+            equal = all(np.abs(a - b).max() <= FLOAT32_ULPS * eps * np.abs(a).max()
+                        for a, b in ((r, r_numba), (v, v_numba)))
+        if not equal or ic_dtype != ic_dtype_numba:
+            failures += 1
+            print(f"backends mismatch: seed={seed} gamma={gamma} integrator={integrator} "
+                  f"contact_mode={contact_mode} dtype={dtype}: max |dr| {np.abs(r - r_numba).max():.3g}, "
+                  f"pairs {ic_dtype.name} and {ic_dtype_numba.name}")
+    return failures
+
+
+def _backends() -> tuple:
+    try:
+        import numba
+    except ImportError:
+        return "numpy",
+    return "numpy", "numba"
+
+
+def check_energy(seeds: int, steps: int) -> int:
+    """
+    :return: number of the failed cases
+    """
+    failures = 0
+    # The particle 0 touches the particles 1 and 2 at once and moves towards both of them, in the second case
+    # the collision with 1 turns it away from 2, so the particle 2 must keep its velocity
+    cases = [
+        ([[0.5, 0.519, 0.481, 0.9], [0.5, 0.5, 0.5, 0.9]],
+         [[0.0, -1.0, 1.5, 0.0], [0.3, 0.2, 0.0, 0.0]], [1.0, 2.0, 3.0, 1.0], False),
+        ([[0.5, 0.519, 0.5 + 0.019 * np.cos(5.0), 0.9], [0.5, 0.5, 0.5 + 0.019 * np.sin(5.0), 0.9]],
+         [[1.9, -1.1, -0.3, 0.0], [-0.8, 2.0, -1.4, 0.0]], [2.0, 1.0, 1.0, 1.0], True),
+    ]
+    for (r, v, m, turned), backend in itertools.product(cases, _backends()):
+        r, v, m = np.array(r), np.array(v), np.array(m)
+        simulation = Simulation(gamma=1.0, k=1000, l_0=0.1, R=0.01, R_spring=0.01, particles_cnt=2, spring_cnt=2,
+                                T=100, m=m[2:], m_spring=m[:2], backend=backend, contact_mode="approaching")
+        simulation._r, simulation._v, simulation._m = r.copy(), v.copy(), m.copy()
+        momentum, kinetic = (m * v).sum(axis=1), (m * v ** 2).sum()
+        # No spring kick and no drift, only the collisions
+        simulation.motion(0.0)
+        new_momentum, new_kinetic = (m * simulation._v).sum(axis=1), (m * simulation._v ** 2).sum()
+        if not (np.allclose(momentum, new_momentum, rtol=0, atol=1e-12) and np.isclose(kinetic, new_kinetic)):
+            failures += 1
+            print(f"energy mismatch: backend={backend} multiple contacts: momentum {momentum} -> {new_momentum}, "
+                  f"kinetic energy {kinetic} -> {new_kinetic}")
+        if turned and not np.array_equal(simulation._v[:, 2], v[:, 2]):
+            failures += 1
+            print(f"energy mismatch: backend={backend}: a pair turned apart by an earlier collision was collided")
+
+    for seed, backend in itertools.product(range(seeds), _backends()):
+        simulation = make_simulation(150, 0.01, 0.025, 1.0, seed, backend=backend, integrator="verlet",
+                                     contact_mode="approaching", fix_energy=False, dt=ENERGY_DT)
+        T = simulation.T
+        simulation.step_many(steps)
+        if abs(simulation.T / T - 1) > ENERGY_DRIFT:
+            failures += 1
+            print(f"energy mismatch: seed={seed} backend={backend}: T/T0 = {simulation.T / T:.4f} "
+                  f"after {steps} steps")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalence checks of the optimized code paths")
+    parser.add_argument("check", choices=("pairs", "backends", "energy"))
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=2000, help="steps of every backends and energy case")
+    args = parser.parse_args()
+
+    if args.check == "pairs":
+        failures = check_pairs(args.seeds)
+    elif args.check == "energy":
+        failures = check_energy(args.seeds, args.steps)
+    else:
+        if len(_backends()) == 1:
+            sys.exit("backends: Numba is not installed")
+        failures = check_backends(args.seeds, args.steps)
+    print(f"{args.check}: {failures} mismatches")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Headless export of the demo screen frames for the video recordings, no window is opened.
+
+The demo screen is drawn on an offscreen surface with the SDL dummy video driver. Every frame advances
+the simulation by the "speed" steps of the slider, as a frame of the live demo does, so the clip plays
+at the live pace at the given fps and a seeded export is reproducible. The frames are rendered as fast
+as the CPU allows and written as a PNG sequence or as raw rgb24 frames into the stdin of an encoder.
+
+Usage: python export_video.py --seconds 600 --png frames
+       python export_video.py --seconds 600 --seed 1 --pipe "ffmpeg -y -f rawvideo -pix_fmt rgb24
+              -s {width}x{height} -r {fps} -i - -pix_fmt yuv420p lecture.mp4"
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import shlex
+import subprocess
+import sys
+import time
+from typing import List
+
+import numpy as np
+import pygame
+
+import config
+from demo_screen import DemoScreen
+from profiling import FrameProfiler
+
+
+class _Monitor:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+
+class OffscreenApp:
+    """
+    Stand-in of App for the screens: an offscreen surface instead of the display
+    """
+
+    def __init__(self, width: int, height: int, seed=None):
+        pygame.init()
+        self.monitor = _Monitor(width, height)
+        self.screen = pygame.Surface((width, height))
+        self.frame_profiler = FrameProfiler()
+        # The inline runner keeps the frames in lockstep with the simulation steps
+        self.demo_screen = DemoScreen(self, seed=seed, runner='inline')
+        self.active_screen = self.demo_screen
+
+
+class PngWriter:
+    def __init__(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.frames = 0
+
+    def write(self, surface: pygame.Surface, dirty: List[pygame.Rect]):
+        pygame.image.save(surface, os.path.join(self.folder, f"frame_{self.frames:06d}.png"))
+        self.frames += 1
+
+    def close(self):
+        pass
+
+
+class PipeWriter:
+    """
+    Raw rgb24 frames written into the stdin of the command
+    """
+
+    def __init__(self, command: str, width: int, height: int):
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+        # Row-major copy of the frame, only the changed areas of the surface are copied into it
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.frames = 0
+        self._failed = False
+
+    def write(self, surface: pygame.Surface, dirty: List[pygame.Rect]):
+        pixels = pygame.surfarray.pixels3d(surface)
+        for rect in dirty:
+            rect = rect.clip(surface.get_rect())
+            area = pixels[rect.left:rect.right, rect.top:rect.bottom].transpose(1, 0, 2)
+            # The channels are copied one by one, a copy of the reversed channels axis at once is a few times slower
+            for channel in range(3):
+                self.frame[rect.top:rect.bottom, rect.left:rect.right, channel] = area[..., channel]
+        del pixels
+        try:
+            self.process.stdin.write(self.frame.data)
+        except BrokenPipeError:
+            self._failed = True
+            raise RuntimeError(f"encoder has exited with code {self.process.wait()} "
+                               f"after {self.frames} frames") from None
+        self.frames += 1
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self._failed = True
+        if self.process.wait() and not self._failed:
+            raise RuntimeError(f"encoder has exited with code {self.process.returncode}")
+
+
+def export(app: OffscreenApp, writer, frames: int, fps: int, report_every: int = 600):
+    screen = app.active_screen
+    start = time.perf_counter()
+    try:
+        for frame_no in range(frames):
+            dirty = screen._update_screen()
+            writer.write(app.screen, dirty)
+            if (frame_no + 1) % report_every == 0 or frame_no + 1 == frames:
+                elapsed = time.perf_counter() - start
+                print(f"{frame_no + 1}/{frames} frames, {(frame_no + 1) / elapsed:.1f} frames/s, "
+                      f"x{(frame_no + 1) / fps / elapsed:.2f} realtime")
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless export of the demo screen frames")
+    duration = parser.add_mutually_exclusive_group(required=True)
+    duration.add_argument("--seconds", type=float, help="duration of the clip")
+    duration.add_argument("--frames", type=int, help="number of the frames")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--png", help="folder of the PNG sequence frame_000000.png, ...")
+    output.add_argument("--pipe", help="encoder command reading raw rgb24 frames from stdin, "
+                                       "{width}, {height} and {fps} are substituted")
+    parser.add_argument("--fps", type=int, default=None, help="frames per second of the clip, FPS config record "
+                                                               "by default")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--seed", type=int, default=None, help="seed of the simulation, random by default")
+    args = parser.parse_args()
+
+    fps = args.fps or config.ConfigLoader()['FPS']
+    frames = args.frames if args.seconds is None else round(args.seconds * fps)
+    if frames < 1 or fps < 1:
+        parser.error("number of the frames and fps must be positive")
+    app = OffscreenApp(args.width, args.height, seed=args.seed)
+    if args.png is not None:
+        writer = PngWriter(args.png)
+    else:
+        writer = PipeWriter(args.pipe.format(width=args.width, height=args.height, fps=fps), args.width, args.height)
+    try:
+        export(app, writer, frames, fps)
+    except RuntimeError as error:
+        sys.exit(f"export failed: {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import pygame
 
 import config
 import language
+from text_cache import TextCache
 from button import Button
 
 
@@ -15,9 +16,9 @@ class MenuScreen:
         self.folder = '_internal/images/'
         self.bg_color = (255, 255, 255)
         self.font = 'sans'
-        self.little_font = pygame.font.SysFont(self.font, 35)
-        self.middle_font = pygame.font.SysFont(self.font, 40, bold=True)
-        self.big_font = pygame.font.SysFont(self.font, 50)
+        self.little_font = TextCache().font(self.font, 35)
+        self.middle_font = TextCache().font(self.font, 40, bold=True)
+        self.big_font = TextCache().font(self.font, 50)
         self.msu_name = lang['university_name']
         self.faculty_name = lang['faculty_name']
         self.demonstration_label = lang['comp_demo']
@@ -78,7 +79,11 @@ class MenuScreen:
             cfg.set("language", "rus")
         lang = language.Language()
         lang.reload()
+        # The demo continues from the same state in the rebuilt screens
+        state = self.app.demo_screen.get_state()
+        self.app.close()
         self.app.__init__()
+        self.app.demo_screen.set_state(state)
 
     def _update_screen(self):
         self.screen.fill(self.bg_color)
@@ -0,0 +1,258 @@
+"""
+Numba-compiled kernels of Simulation.motion, used by Simulation(backend="numba").
+Every kernel repeats the arithmetic of the NumPy code path, so both backends give the same float64 trajectories
+(float32 ones differ by rounding, some intermediates are computed in float64). See equivalence.py backends.
+"""
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _append(pairs, cnt, i, j):
+    if cnt == pairs.shape[0]:
+        grown = np.empty((2 * pairs.shape[0], 2), dtype=pairs.dtype)
+        grown[:cnt] = pairs[:cnt]
+        pairs = grown
+    pairs[cnt, 0] = i
+    pairs[cnt, 1] = j
+    return pairs
+
+
+@njit(cache=True)
+def find_contacts(r, n_spring, R, R_spring, index_dtype):
+    """
+    Spring particles are checked against all the others directly (there are only a few of them),
+    the bath particles pairs are found by the cell-list broad phase
+    :param index_dtype: integer type of the returned pairs, the cells are always indexed by int64
+    :return: pairs in contact in the same order as in the NumPy path: spring pairs, particles pairs,
+    spring-particles pairs, each group sorted lexicographically
+    """
+    n = r.shape[1]
+    cap = max(16, n)
+    spring_pairs = np.empty((cap, 2), dtype=index_dtype)
+    spring_particles_pairs = np.empty((cap, 2), dtype=index_dtype)
+    cnt_spring, cnt_spring_particles = 0, 0
+    for i in range(n_spring):
+        for j in range(i + 1, n):
+            d2 = (r[0, i] - r[0, j]) ** 2 + (r[1, i] - r[1, j]) ** 2
+            if j < n_spring:
+                if d2 < (2 * R_spring) ** 2:
+                    spring_pairs = _append(spring_pairs, cnt_spring, i, j)
+                    cnt_spring += 1
+            elif d2 < (R + R_spring) ** 2:
+                spring_particles_pairs = _append(spring_particles_pairs, cnt_spring_particles, i, j)
+                cnt_spring_particles += 1
+
+    n_cells = int(min(max(1 / (2 * R), 1), 1024)) if R > 0 else 1
+    side = n_cells + 2
+    cells = np.empty(n, dtype=np.int64)
+    counts = np.zeros(side * side + 1, dtype=np.int64)
+    for i in range(n_spring, n):
+        cx = min(max(int(np.floor(r[0, i] * n_cells)), 0), n_cells - 1) + 1
+        cy = min(max(int(np.floor(r[1, i] * n_cells)), 0), n_cells - 1) + 1
+        cells[i] = cx * side + cy
+        counts[cells[i] + 1] += 1
+    starts = np.cumsum(counts)
+    fill = starts[:-1].copy()
+    order = np.empty(n - n_spring, dtype=np.int64)
+    for i in range(n_spring, n):
+        order[fill[cells[i]]] = i
+        fill[cells[i]] += 1
+
+    # Pairs are emitted in lexicographic order: i ascending and the few neighbours j of i are sorted in place
+    particles_pairs = np.empty((cap, 2), dtype=index_dtype)
+    cnt_particles = 0
+    for i in range(n_spring, n):
+        first = cnt_particles
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                cell = cells[i] + dx * side + dy
+                for pos in range(starts[cell], starts[cell + 1]):
+                    j = order[pos]
+                    if j > i and (r[0, i] - r[0, j]) ** 2 + (r[1, i] - r[1, j]) ** 2 < (2 * R) ** 2:
+                        particles_pairs = _append(particles_pairs, cnt_particles, i, j)
+                        cnt_particles += 1
+        for p in range(first + 1, cnt_particles):
+            j = particles_pairs[p, 1]
+            q = p
+            while q > first and particles_pairs[q - 1, 1] > j:
+                particles_pairs[q, 1] = particles_pairs[q - 1, 1]
+                q -= 1
+            particles_pairs[q, 1] = j
+
+    ic = np.empty((cnt_spring + cnt_particles + cnt_spring_particles, 2), dtype=index_dtype)
+    ic[:cnt_spring] = spring_pairs[:cnt_spring]
+    ic[cnt_spring:cnt_spring + cnt_particles] = particles_pairs[:cnt_particles]
+    ic[cnt_spring + cnt_particles:] = spring_particles_pairs[:cnt_spring_particles]
+    return ic
+
+
+@njit(cache=True)
+def exclude_pairs(ic, last_ic, n):
+    """
+    :return: pairs of ic that are not in last_ic
+    """
+    if last_ic.shape[0] == 0:
+        return ic
+    # last_ic grouped by the first particle of the pair
+    starts = np.zeros(n + 1, dtype=np.int64)
+    for p in range(last_ic.shape[0]):
+        starts[last_ic[p, 0] + 1] += 1
+    starts = np.cumsum(starts)
+    fill = starts[:-1].copy()
+    last_js = np.empty(last_ic.shape[0], dtype=np.int64)
+    for p in range(last_ic.shape[0]):
+        last_js[fill[last_ic[p, 0]]] = last_ic[p, 1]
+        fill[last_ic[p, 0]] += 1
+
+    keep = np.ones(ic.shape[0], dtype=np.bool_)
+    for p in range(ic.shape[0]):
+        i, j = ic[p, 0], ic[p, 1]
+        for pos in range(starts[i], starts[i + 1]):
+            if last_js[pos] == j:
+                keep[p] = False
+                break
+    return ic[keep]
+
+
+@njit(cache=True)
+def approaching_pairs(ic, r, v):
+    """
+    :return: pairs of ic that move towards each other
+    """
+    keep = np.empty(ic.shape[0], dtype=np.bool_)
+    for p in range(ic.shape[0]):
+        i, j = ic[p, 0], ic[p, 1]
+        keep[p] = ((v[0, i] - v[0, j]) * (r[0, i] - r[0, j]) + (v[1, i] - v[1, j]) * (r[1, i] - r[1, j])) < 0
+    return ic[keep]
+
+
+@njit(cache=True)
+def collide(r, v, m, ic, approaching=False):
+    """
+    Elastic collisions of the pairs ic resolved one after another in the order of ic,
+    so a particle of several pairs takes part in all of them
+    :param approaching: a pair is collided only if it still moves towards each other after the earlier collisions
+    """
+    for p in range(ic.shape[0]):
+        i, j = ic[p, 0], ic[p, 1]
+        if approaching and ((v[0, i] - v[0, j]) * (r[0, i] - r[0, j])
+                            + (v[1, i] - v[1, j]) * (r[1, i] - r[1, j])) >= 0:
+            continue
+        m_s = m[i] + m[j]
+        drx, dry = r[0, i] - r[0, j], r[1, i] - r[1, j]
+        dr_norm_sq = np.sqrt(drx * drx + dry * dry) ** 2
+        c1, c2 = 2 * m[j] / m_s, 2 * m[i] / m_s
+        s1 = c1 * (v[0, i] - v[0, j]) * drx + c1 * (v[1, i] - v[1, j]) * dry
+        s2 = c2 * (v[0, j] - v[0, i]) * drx + c2 * (v[1, j] - v[1, i]) * dry
+        v1x, v1y = v[0, i] - (s1 * drx) / dr_norm_sq, v[1, i] - (s1 * dry) / dr_norm_sq
+        v2x, v2y = v[0, j] - (s2 * drx) / dr_norm_sq, v[1, j] - (s2 * dry) / dr_norm_sq
+        v[0, i], v[1, i] = v1x, v1y
+        v[0, j], v[1, j] = v2x, v2y
+
+
+@njit(cache=True)
+def spring_kick(r, v, m, bonds, k, gamma, l_0, dt):
+    """
+    Kicks the velocities of the bonded particles by the spring forces,
+    all the forces are computed before the first kick
+    :return: sum of f @ dr over the bonds
+    """
+    n_bonds = bonds.shape[0]
+    f = np.empty((2, n_bonds))
+    total = 0.0
+    for b in range(n_bonds):
+        i, j = bonds[b, 0], bonds[b, 1]
+        drx, dry = r[0, i] - r[0, j], r[1, i] - r[1, j]
+        dr_sc = np.sqrt(drx * drx + dry * dry)
+        dx_norm = np.abs(dr_sc - l_0)
+        coef = k * (dx_norm ** (gamma - 1))
+        f[0, b] = coef * (drx * (1 - l_0 / dr_sc))
+        f[1, b] = coef * (dry * (1 - l_0 / dr_sc))
+        total += f[0, b] * drx + f[1, b] * dry
+    for b in range(n_bonds):
+        i, j = bonds[b, 0], bonds[b, 1]
+        v[0, i] -= f[0, b] * (dt / m[i])
+        v[1, i] -= f[1, b] * (dt / m[i])
+        v[0, j] += f[0, b] * (dt / m[j])
+        v[1, j] += f[1, b] * (dt / m[j])
+    return total
+
+
+@njit(cache=True)
+def reflect_walls(r, v):
+    for axis in range(2):
+        for i in range(r.shape[1]):
+            if r[axis, i] > 1:
+                v[axis, i] = -np.abs(v[axis, i])
+            elif r[axis, i] < 0:
+                v[axis, i] = np.abs(v[axis, i])
+
+
+@njit(cache=True)
+def mirror_walls(r, v):
+    """
+    Mirrors the particles that have crossed a wall back into the box and reverses their velocities
+    """
+    for axis in range(2):
+        for i in range(r.shape[1]):
+            if r[axis, i] > 1:
+                r[axis, i] = 2 - r[axis, i]
+                v[axis, i] = -v[axis, i]
+            elif r[axis, i] < 0:
+                r[axis, i] = -r[axis, i]
+                v[axis, i] = -v[axis, i]
+
+
+@njit(cache=True)
+def drift(r, v, dt):
+    for axis in range(2):
+        for i in range(r.shape[1]):
+            r[axis, i] += v[axis, i] * dt
+
+
+@njit(cache=True)
+def predict_event(r, v, radii, i, last, n_skip):
+    """
+    Next event of the particle i for EventSimulation, the same arithmetic as EventSimulation._predict.
+    Particles below n_skip are not partners (the spring ones during a free flight), last is the previous partner
+    :return: time left until the event and its partner, a wall one is -axis - 1
+    """
+    x, y = r[0, i], r[1, i]
+    vx, vy = v[0, i], v[1, i]
+    t_best, partner = np.inf, -3
+    for axis in range(2):
+        pos, vel = r[axis, i], v[axis, i]
+        if vel > 0:
+            t = max((1 - pos) / vel, 0.0)
+        elif vel < 0:
+            t = max(-pos / vel, 0.0)
+        else:
+            continue
+        if t < t_best:
+            t_best, partner = t, -axis - 1
+
+    t_pair, j_pair = np.inf, -1
+    for j in range(n_skip, r.shape[1]):
+        if j == i:
+            continue
+        dx, dy = r[0, j] - x, r[1, j] - y
+        dvx, dvy = v[0, j] - vx, v[1, j] - vy
+        b = dx * dvx + dy * dvy
+        if b >= 0:
+            continue
+        dv2 = dvx * dvx + dvy * dvy
+        dr2 = dx * dx + dy * dy
+        sigma2 = (radii[j] + radii[i]) ** 2
+        disc = b * b - dv2 * (dr2 - sigma2)
+        if disc <= 0:
+            continue
+        # The pair has just collided, rounding errors must not make it collide once again
+        if j == last and dr2 <= sigma2 * (1 + 1e-9):
+            continue
+        t = -(b + np.sqrt(disc)) / dv2
+        if t < t_pair:
+            t_pair, j_pair = t, j
+    if j_pair >= 0 and t_pair < t_best:
+        t_best, partner = max(t_pair, 0.0), j_pair
+    return t_best, partner
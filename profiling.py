@@ -0,0 +1,212 @@
+"""
+Opt-in timing instrumentation of the simulation steps and of the frames of the App main loop.
+"""
+import json
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class PhaseStats:
+    """
+    Wall time and number of calls of every phase of Simulation.motion and Simulation._step
+    and the numbers of the contact pairs per step. See Simulation.profile
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.steps = 0
+        # Pairs found by the broad phase and pairs actually collided, summed over the steps
+        self.contacts = 0
+        self.collisions = 0
+        self.max_contacts = 0
+
+    @staticmethod
+    def start() -> float:
+        return time.perf_counter()
+
+    def lap(self, phase: str, start: float) -> float:
+        """
+        Adds the time since start to the phase
+        :return: current time, the start of the next phase
+        """
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + (now - start)
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        return now
+
+    def add_contacts(self, contacts: int, collisions: int):
+        self.contacts += contacts
+        self.collisions += collisions
+        self.max_contacts = max(self.max_contacts, contacts)
+
+    def as_dict(self) -> dict:
+        return dict(steps=self.steps, times=dict(self.times), calls=dict(self.calls), contacts=self.contacts,
+                    collisions=self.collisions, max_contacts=self.max_contacts)
+
+    def report(self) -> str:
+        """
+        :return: table of the phases sorted by their total time
+        """
+        total = sum(self.times.values())
+        lines = [f"{'phase':<12}{'total, s':>10}{'calls':>10}{'us/call':>10}{'share':>8}"]
+        for phase, seconds in sorted(self.times.items(), key=lambda item: -item[1]):
+            calls = self.calls[phase]
+            lines.append(f"{phase:<12}{seconds:>10.3f}{calls:>10}{seconds / calls * 1e6:>10.1f}"
+                         f"{seconds / total if total else 0:>8.1%}")
+        steps = max(self.steps, 1)
+        lines.append(f"{self.steps} steps, contacts per step {self.contacts / steps:.1f} "
+                     f"(max {self.max_contacts}), collisions per step {self.collisions / steps:.1f}")
+        return "\n".join(lines)
+
+
+def _disjoint(rects: List) -> List:
+    """
+    :return: disjoint pygame.Rect covering the same area as rects
+    """
+    parts = []
+    for rect in rects:
+        pieces = [rect]
+        for part in parts:
+            split = []
+            for piece in pieces:
+                if not piece.colliderect(part):
+                    split.append(piece)
+                    continue
+                inner = piece.clip(part)
+                # Strips of the piece above, below, left and right of the overlap
+                split += [r for r in (piece.clip(piece.left, piece.top, piece.width, inner.top - piece.top),
+                                      piece.clip(piece.left, inner.bottom, piece.width, piece.bottom - inner.bottom),
+                                      piece.clip(piece.left, inner.top, inner.left - piece.left, inner.height),
+                                      piece.clip(inner.right, inner.top, piece.right - inner.right, inner.height))
+                          if r.width > 0 and r.height > 0]
+            pieces = split
+        parts += pieces
+    return parts
+
+
+class FrameProfiler:
+    """
+    Frame-time breakdown of the App main loop. Every stage of a frame ends with lap(stage),
+    so the stage times sum up to the frame time. The last frames are kept for the percentiles
+    of the overlay and for the Chrome trace-event export (chrome://tracing, Perfetto)
+    """
+    PERCENTILES = (50, 95, 99)
+    # Frames between two updates of the overlay text
+    HUD_REFRESH = 30
+
+    def __init__(self, history: int = 600, trace_frames: int = 3600):
+        """
+        :param history: number of the last frames the percentiles are computed over
+        :param trace_frames: number of the last frames kept for the trace export
+        """
+        self.visible = False
+        self._history = history
+        self._stages: Dict[str, deque] = {}
+        self._trace = deque(maxlen=trace_frames)
+        self._origin = time.perf_counter()
+        self._frame_start = self._t = self._origin
+        self._laps = []
+        self._frames = 0
+        # Composed overlay panel, its rect on the screen and the frame it was composed in
+        self._hud = None
+        self._hud_rect = None
+        self._hud_frame = 0
+
+    def begin_frame(self):
+        self._frame_start = self._t = time.perf_counter()
+        self._laps = []
+
+    def lap(self, stage: str):
+        """
+        Ends the stage started by the previous lap or by begin_frame
+        """
+        now = time.perf_counter()
+        self._laps.append((stage, self._t, now - self._t))
+        self._t = now
+
+    def end_frame(self):
+        durations = {"frame": self._t - self._frame_start}
+        for stage, _, duration in self._laps:
+            durations[stage] = durations.get(stage, 0.0) + duration
+        for stage, duration in durations.items():
+            if stage not in self._stages:
+                self._stages[stage] = deque(maxlen=self._history)
+            self._stages[stage].append(duration)
+        self._trace.append((self._frame_start, self._t - self._frame_start, self._laps))
+        self._frames += 1
+
+    def percentiles(self) -> Dict[str, Tuple[float, ...]]:
+        """
+        :return: PERCENTILES of the time of every stage in seconds, the frames without the stage are skipped
+        """
+        return {stage: tuple(np.percentile(durations, self.PERCENTILES))
+                for stage, durations in self._stages.items() if durations}
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def _compose_hud(self):
+        import pygame
+        from text_cache import TextCache
+        font = TextCache().font('consolas', 18)
+        rows = sorted(self.percentiles().items(), key=lambda item: (item[0] != "frame", -item[1][0]))
+        lines = [f"{'stage':<10}" + "".join(f"{f'p{p}':>8}" for p in self.PERCENTILES)]
+        lines += [f"{stage:<10}" + "".join(f"{value * 1e3:>8.2f}" for value in values) for stage, values in rows]
+        lines = [font.render(line, True, (255, 255, 255)) for line in lines]
+        panel = pygame.Surface((max(line.get_width() for line in lines) + 10,
+                                sum(line.get_height() for line in lines) + 10), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        y = 5
+        for line in lines:
+            panel.blit(line, (5, y))
+            y += line.get_height()
+        self._hud = panel
+        self._hud_frame = self._frames
+
+    def draw(self, screen, dirty: Optional[List] = None, position: Tuple[int, int] = (10, 10)):
+        """
+        Draws the overlay table of the stages percentiles in milliseconds if it's visible.
+        The overlay is translucent, so it's blended only over the areas redrawn in this frame,
+        the rest of the screen keeps the overlay of the previous frames
+        :param dirty: areas of the screen redrawn in this frame, None if the whole screen is redrawn
+        :return: rect of the screen to be restored by the next frame (the overlay is recomposed or hidden) or None
+        """
+        import pygame
+        if not self.visible:
+            restore, self._hud, self._hud_rect = self._hud_rect, None, None
+            return restore
+        restore = None
+        if self._hud is None or self._frames - self._hud_frame >= self.HUD_REFRESH:
+            restore = self._hud_rect
+            self._compose_hud()
+            self._hud_rect = pygame.Rect(position, self._hud.get_size())
+            # The new overlay is drawn over the whole rect after it's restored
+            restore = self._hud_rect if restore is None else restore.union(self._hud_rect)
+        rect = self._hud_rect
+        if dirty is None:
+            screen.blit(self._hud, rect)
+            return restore
+        for area in _disjoint([area.clip(rect) for area in dirty if area.colliderect(rect)]):
+            screen.blit(self._hud, area, area.move(-rect.x, -rect.y))
+        return restore
+
+    def export_trace(self, path: str):
+        """
+        Writes the kept frames as Chrome trace-event json: one complete event per frame
+        with the events of its stages nested in it
+        """
+        events = []
+        for frame_no, (start, duration, laps) in enumerate(self._trace):
+            events.append(dict(name="frame", ph="X", pid=1, tid=1, ts=(start - self._origin) * 1e6,
+                               dur=duration * 1e6, args=dict(frame=frame_no)))
+            events += [dict(name=stage, ph="X", pid=1, tid=1, ts=(stage_start - self._origin) * 1e6,
+                            dur=stage_duration * 1e6) for stage, stage_start, stage_duration in laps]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
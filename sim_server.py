@@ -0,0 +1,312 @@
+"""
+Simulation running in a separate process, its state is published through shared memory.
+
+The shared block consists of a header, the positions of all the particles, the bonds and a ring buffer
+of the observables of every step. The positions are guarded by a sequence counter (seqlock): it is odd
+while the server writes them, so a reader sees whether its read has overlapped a write.
+The ring buffer is append-only, every reader keeps its own cursor, so one server can feed many viewers.
+"""
+import atexit
+import multiprocessing as mp
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from simulation import Simulation, Observables
+from sim_thread import Snapshot
+
+# Integer header fields
+_SEQ, _HEAD, _N, _N_SPRING, _STEPS, _CAPACITY, _N_BONDS, _RING, _DTYPE = range(9)
+_HEADER_INTS = 16
+# Float header fields
+_R, _R_SPRING, _EXPECTED_KINETIC, _EXPECTED_POTENTIAL = range(4)
+_HEADER_FLOATS = 8
+_ALIGN = 64
+_DTYPES = ("float64", "float32")
+# Names of the blocks created by the servers of this process
+_created = set()
+
+
+def _layout(capacity: int, n_bonds: int, ring: int, dtype: str) -> Tuple[Dict[str, tuple], int]:
+    """
+    :return: offset, dtype and shape of every array of the shared block and the block size
+    """
+    arrays = dict(ints=(np.int64, (_HEADER_INTS, )), floats=(np.float64, (_HEADER_FLOATS, )),
+                  r=(dtype, (2, capacity)), bonds=(np.int64, (n_bonds, 2)),
+                  ring=(np.float64, (len(Observables._fields), ring)))
+    layout, offset = {}, 0
+    for name, (arr_dtype, shape) in arrays.items():
+        layout[name] = (offset, arr_dtype, shape)
+        offset += -(-int(np.prod(shape)) * np.dtype(arr_dtype).itemsize // _ALIGN) * _ALIGN
+    return layout, offset
+
+
+def _tracks(name: str) -> bool:
+    """
+    Must be called before the block is mapped
+    :return: True if the resource tracker of this process already tracks the block of its creator: the block
+    is created in this process or the tracker is inherited from the parent (fork, spawn and forkserver on POSIX),
+    mapping the block then only repeats the registration of the creator and it must be kept
+    """
+    return name in _created or (mp.parent_process() is not None and resource_tracker._resource_tracker._fd is not None)
+
+
+def _map(buf, layout: Dict[str, tuple]) -> Dict[str, ndarray]:
+    return {name: np.ndarray(shape, dtype=arr_dtype, buffer=buf, offset=offset)
+            for name, (offset, arr_dtype, shape) in layout.items()}
+
+
+class SharedSimulationView:
+    """
+    Read-only access to the state published by SimulationServer, see attach()
+    """
+
+    def __init__(self, shm: SharedMemory):
+        self._shm = shm
+        header = np.ndarray((_HEADER_INTS, ), dtype=np.int64, buffer=shm.buf)
+        self._layout, _ = _layout(int(header[_CAPACITY]), int(header[_N_BONDS]), int(header[_RING]),
+                               _DTYPES[int(header[_DTYPE])])
+        del header
+        self._views = _map(shm.buf, self._layout)
+        self._snapshot = Snapshot()
+        self._seq = 0
+        self._cursor = 0
+
+    @classmethod
+    def attach(cls, name: str):
+        """
+        Maps the shared block of a running server, e.g. from another viewer process
+        """
+        tracked = _tracks(name)
+        shm = SharedMemory(name)
+        # The block is owned by the server, the exit of a viewer must not unlink it
+        if not tracked:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def acquire(self) -> Optional[Snapshot]:
+        """
+        :return: snapshot whose arrays are views of the shared memory (no copies), or None if nothing
+        is published yet. The server doesn't wait for the readers: release() tells if the state
+        has been rewritten during the read, the positions then mix two adjacent steps
+        """
+        ints, floats = self._views["ints"], self._views["floats"]
+        seq = int(ints[_SEQ])
+        while seq % 2:
+            time.sleep(0)
+            seq = int(ints[_SEQ])
+        if seq == 0:
+            return None
+        self._seq = seq
+        snapshot = self._snapshot
+        snapshot.r = self._views["r"][:, :int(ints[_N])]
+        snapshot.n_spring = int(ints[_N_SPRING])
+        snapshot.R, snapshot.R_spring = float(floats[_R]), float(floats[_R_SPRING])
+        snapshot.bonds = self._views["bonds"]
+        snapshot.steps = int(ints[_STEPS])
+        return snapshot
+
+    def release(self) -> bool:
+        """
+        :return: True if the acquired snapshot was consistent
+        """
+        return int(self._views["ints"][_SEQ]) == self._seq
+
+    def take_observables(self) -> Observables:
+        """
+        :return: observables of the steps published since the previous call,
+        the steps overwritten in the ring before they were taken are skipped
+        """
+        ring = self._views["ring"]
+        size = ring.shape[1]
+        head = int(self._views["ints"][_HEAD])
+        start = max(self._cursor, head - size)
+        ids = np.arange(start, head) % size
+        records = ring[:, ids]
+        # Records rewritten during the copy are dropped
+        lost = int(self._views["ints"][_HEAD]) - size - start
+        if lost > 0:
+            records = records[:, lost:]
+        self._cursor = head
+        return Observables(*records)
+
+    def expected_kinetic_energy(self) -> float:
+        return float(self._views["floats"][_EXPECTED_KINETIC])
+
+    def expected_potential_energy(self) -> float:
+        return float(self._views["floats"][_EXPECTED_POTENTIAL])
+
+    def close(self):
+        self._snapshot = Snapshot()
+        self._views = None
+        self._shm.close()
+
+
+class SimulationServer(SharedSimulationView):
+    def __init__(self, simulation: Simulation, capacity: Optional[int] = None, ring: int = 4096,
+                 block: int = 10, frames_c: Optional[int] = None):
+        """
+        The server process continues the given simulation from its current state,
+        the simulation object itself is not advanced
+        :param capacity: max number of the particles (with the spring ones), the shared block is sized to it
+        :param ring: number of the steps kept in the observables ring buffer
+        :param block: number of the steps between two publications of the positions
+        :param frames_c: averaging window of the published mean energies, see Simulation.mean_kinetic_energy
+        """
+        n = simulation._r.shape[1]
+        capacity = n if capacity is None else capacity
+        if capacity < n or ring < 1:
+            raise ValueError("capacity must be >= number of the particles and ring must be positive")
+        _, size = _layout(capacity, simulation.bonds.shape[0], ring, simulation.dtype)
+        shm = SharedMemory(create=True, size=size)
+        _created.add(shm.name)
+        ints = np.ndarray((_HEADER_INTS, ), dtype=np.int64, buffer=shm.buf)
+        ints[:] = 0
+        ints[[_N, _N_SPRING, _CAPACITY, _N_BONDS, _RING, _DTYPE]] = (
+            n, simulation._n_spring, capacity, simulation.bonds.shape[0], ring, _DTYPES.index(simulation.dtype))
+        del ints
+        super().__init__(shm)
+        self._views["bonds"][...] = simulation.bonds
+
+        scalars, arrays = simulation._get_state()
+        self._commands = mp.Queue()
+        self._errors = mp.Queue()
+        self._states = mp.Queue()
+        self._block = block
+        self._process = mp.Process(
+            target=_serve, name="simulation server", daemon=True,
+            args=(shm.name, type(simulation), scalars, arrays, self._commands, self._errors, self._states, block,
+                  frames_c),
+        )
+
+    def start(self):
+        self._process.start()
+        atexit.register(self.stop)
+
+    @property
+    def block(self) -> int:
+        return self._block
+
+    @block.setter
+    def block(self, val: int):
+        if val < 1:
+            raise ValueError("block must be positive")
+        if val != self._block:
+            self._block = int(val)
+            self._commands.put(("block", self._block))
+
+    def set_params(self, **kwargs):
+        """
+        Simulation.set_params in the server process, its errors are raised by the next acquire()
+        """
+        self._commands.put(("set_params", kwargs))
+
+    def get_state(self, timeout: float = 5.0) -> Tuple[dict, dict]:
+        """
+        :return: Simulation._get_state() of the server process taken between two blocks
+        """
+        self._commands.put(("state", None))
+        try:
+            return self._states.get(timeout=timeout)
+        except Empty:
+            self._check_error()
+            raise RuntimeError("simulation server doesn't respond") from None
+
+    def acquire(self) -> Optional[Snapshot]:
+        self._check_error()
+        return super().acquire()
+
+    def _check_error(self):
+        try:
+            error = self._errors.get_nowait()
+        except Empty:
+            return
+        raise error
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stops the server process and frees the shared memory
+        """
+        if self._views is None:
+            return
+        atexit.unregister(self.stop)
+        if self._process.is_alive():
+            self._commands.put(("stop", None))
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+        for queue in (self._commands, self._errors, self._states):
+            queue.close()
+            queue.join_thread()
+        self.close()
+        self._shm.unlink()
+        _created.discard(self._shm.name)
+
+
+def _serve(name: str, cls: type, scalars: dict, arrays: dict, commands: mp.Queue, errors: mp.Queue,
+           states: mp.Queue, block: int, frames_c: Optional[int]):
+    tracked = _tracks(name)
+    shm = SharedMemory(name)
+    # The block is owned by the parent, it's unlinked by SimulationServer.stop()
+    if not tracked:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    view = SharedSimulationView(shm)
+    ints, floats, r, ring = (view._views[key] for key in ("ints", "floats", "r", "ring"))
+    simulation = cls.__new__(cls)
+    simulation._set_state(scalars, arrays)
+    n_spring = simulation._n_spring
+
+    def publish():
+        n = simulation._r.shape[1]
+        ints[_SEQ] += 1
+        ints[_N] = n
+        r[:, :n] = simulation._r
+        floats[_R], floats[_R_SPRING] = simulation.R, simulation.R_spring
+        floats[_EXPECTED_KINETIC] = simulation.expected_kinetic_energy()
+        floats[_EXPECTED_POTENTIAL] = simulation.expected_potential_energy()
+        ints[_SEQ] += 1
+
+    try:
+        publish()
+        while True:
+            try:
+                command, arg = commands.get_nowait()
+            except Empty:
+                command = None
+            if command == "stop":
+                break
+            if command == "block":
+                block = arg
+            elif command == "state":
+                states.put(simulation._get_state())
+            elif command == "set_params":
+                try:
+                    if arg.get("particles_cnt", 0) + n_spring > r.shape[1]:
+                        raise ValueError(f"particles_cnt must be <= {r.shape[1] - n_spring}")
+                    simulation.set_params(**arg)
+                except ValueError as error:
+                    errors.put(error)
+            if command is not None:
+                continue
+
+            observables = simulation.step_many(block, frames_c=frames_c)
+            head = int(ints[_HEAD])
+            ids = np.arange(head, head + block) % ring.shape[1]
+            ring[:, ids] = np.stack(observables)
+            ints[_HEAD] = head + block
+            ints[_STEPS] += block
+            publish()
+    except Exception as error:
+        errors.put(error)
+    finally:
+        del ints, floats, r, ring
+        view.close()
@@ -0,0 +1,185 @@
+"""
+Simulation running continuously on a worker thread, decoupled from the render loop.
+
+The worker advances the simulation by blocks of steps (the NumPy kernels release the GIL, so it uses the time
+the main thread spends drawing and sleeping in clock.tick) and publishes the positions into one of two
+preallocated snapshots. Readers never wait for the physics and the physics never waits for the readers.
+"""
+import threading
+from collections import deque
+from queue import SimpleQueue, Empty
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from simulation import Simulation, Observables
+
+
+class Snapshot:
+    """
+    Published state of the simulation, the arrays are reused by the next publications into the same buffer
+    """
+
+    def __init__(self):
+        self.r = np.empty((2, 0))
+        self.n_spring = 0
+        self.R = 0.0
+        self.R_spring = 0.0
+        self.bonds = np.zeros((0, 2), dtype=int)
+        self.steps = 0
+
+    @property
+    def r_spring(self) -> ndarray:
+        return self.r[:, :self.n_spring]
+
+    @property
+    def r_particles(self) -> ndarray:
+        return self.r[:, self.n_spring:]
+
+    def fill(self, simulation: Simulation, steps: int):
+        if self.r.shape != simulation._r.shape or self.r.dtype != simulation._r.dtype:
+            self.r = np.empty_like(simulation._r)
+        np.copyto(self.r, simulation._r)
+        self.n_spring = simulation._n_spring
+        self.R, self.R_spring = simulation.R, simulation.R_spring
+        self.bonds = simulation.bonds
+        self.steps = steps
+
+
+class SimulationThread(threading.Thread):
+    # Max number of the published observables blocks kept until they are taken, older ones are dropped
+    MAX_PENDING = 256
+
+    def __init__(self, simulation: Simulation, block: int = 10, frames_c: Optional[int] = None):
+        """
+        :param block: number of the steps between two publications
+        :param frames_c: averaging window of the published mean energies, see Simulation.mean_kinetic_energy
+        """
+        super().__init__(name="simulation", daemon=True)
+        self.simulation = simulation
+        self.block = block
+        self.frames_c = frames_c
+        self._buffers = (Snapshot(), Snapshot())
+        self._front = 0
+        # Buffer held by a reader, the worker skips the publication instead of overwriting it
+        self._reading = None
+        self._published = False
+        self._lock = threading.Lock()
+        self._observables = deque(maxlen=self.MAX_PENDING)
+        self._commands = SimpleQueue()
+        self._stop_event = threading.Event()
+        self._error = None
+        self._steps = 0
+
+    @property
+    def block(self) -> int:
+        return self._block
+
+    @block.setter
+    def block(self, val: int):
+        if val < 1:
+            raise ValueError("block must be positive")
+        self._block = int(val)
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                self._run_commands()
+                self._observables.append(self.simulation.step_many(self._block, frames_c=self.frames_c))
+                self._steps += self._block
+                self._publish()
+        except Exception as error:
+            self._error = error
+
+    def _run_commands(self):
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except Empty:
+                return
+            command(self.simulation)
+
+    def _publish(self):
+        with self._lock:
+            back = 1 - self._front
+            if self._reading == back:
+                return
+        self._buffers[back].fill(self.simulation, self._steps)
+        with self._lock:
+            self._front = back
+            self._published = True
+
+    def submit(self, command: Callable[[Simulation], None]):
+        """
+        Schedules command(simulation) on the worker thread before the next block,
+        the simulation must not be modified from the other threads directly
+        """
+        self._commands.put(command)
+
+    def set_params(self, **kwargs):
+        self.submit(lambda simulation: simulation.set_params(**kwargs))
+
+    def get_state(self, timeout: float = 5.0) -> Tuple[dict, dict]:
+        """
+        :return: copy of Simulation._get_state() taken on the worker thread between two blocks
+        """
+        if not self.is_alive():
+            self._check_error()
+            scalars, arrays = self.simulation._get_state()
+            return scalars, {name: np.array(arr) for name, arr in arrays.items()}
+        states = []
+        taken = threading.Event()
+
+        def take(simulation: Simulation):
+            scalars, arrays = simulation._get_state()
+            states.append((scalars, {name: np.array(arr) for name, arr in arrays.items()}))
+            taken.set()
+
+        self.submit(take)
+        if not taken.wait(timeout):
+            self._check_error()
+            raise RuntimeError("simulation thread doesn't respond")
+        return states[0]
+
+    def expected_kinetic_energy(self) -> float:
+        return self.simulation.expected_kinetic_energy()
+
+    def expected_potential_energy(self) -> float:
+        return self.simulation.expected_potential_energy()
+
+    def acquire(self) -> Optional[Snapshot]:
+        """
+        :return: the latest published snapshot or None if nothing is published yet,
+        it is not overwritten until release() is called
+        """
+        self._check_error()
+        with self._lock:
+            if not self._published:
+                return None
+            self._reading = self._front
+            return self._buffers[self._front]
+
+    def release(self):
+        with self._lock:
+            self._reading = None
+
+    def take_observables(self) -> Observables:
+        """
+        :return: observables of all the steps published since the previous call
+        """
+        self._check_error()
+        blocks = []
+        while self._observables:
+            blocks.append(self._observables.popleft())
+        return Observables(*(np.concatenate([getattr(b, name) for b in blocks] + [np.empty(0)])
+                             for name in Observables._fields))
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError("simulation thread has failed") from self._error
@@ -1,104 +1,301 @@
-import itertools
 import numpy as np
 from numpy import ndarray
-from typing import Tuple, Union
+from typing import NamedTuple, Tuple, Union
 from scipy import stats, integrate
-from bisect import bisect_left
+from functools import lru_cache
+from contextlib import contextmanager
+import json
+import os
 import warnings
 
+from accumulators import RunningStats
+from profiling import PhaseStats
+
+# Checkpoint file layout: magic, header length (uint64), json header, arrays aligned to _SNAPSHOT_ALIGN bytes
+_SNAPSHOT_MAGIC = b"NLSIM\x00\x01\x00"
+_SNAPSHOT_ALIGN = 64
+
+
+class Observables(NamedTuple):
+    """
+    Observables recorded by Simulation.step_many, one element per record
+    """
+    kinetic: ndarray
+    potential: ndarray
+    mean_kinetic: ndarray
+    mean_potential: ndarray
+    full_energy: ndarray
+    force: ndarray
+
 
 class Simulation:
+    CONTACT_MODES = ("available", "approaching")
+    BACKENDS = ("numpy", "numba")
+    INTEGRATORS = ("euler", "verlet")
+    # Float types of the state and the matching compact types of the particle indexes
+    DTYPES = {"float64": np.intp, "float32": np.int32}
+    # Up to this many candidate pairs get_contact_pairs checks all of them, the grid costs more below ~150 particles
+    DIRECT_PAIRS = 128 * 128
+    # Max number of the last frames the energies can be averaged over
+    ENERGY_WINDOW = 2 ** 16
+
     def __init__(self, gamma: float, k: float, l_0: float, R: float, R_spring: float,
                  particles_cnt: int, spring_cnt: int,
                  T: float,
-                 m: ndarray, m_spring: ndarray):
+                 m: ndarray, m_spring: ndarray,
+                 contact_mode: str = "available", backend: str = "numpy",
+                 seed: Union[int, np.random.SeedSequence, None] = None,
+                 bonds: ndarray = None,
+                 integrator: str = "euler", dt: float = 0.00001, fix_energy: bool = True,
+                 dtype: str = "float64"):
+        """
+        :param contact_mode: "available" - pairs that were in contact on the previous step are not collided,
+        "approaching" - only pairs moving towards each other are collided, no per-pair state is kept,
+        the pairs sharing a particle are resolved one after another and each is checked again before its collision
+        :param backend: "numpy" or "numba" - Numba-compiled kernels of motion(),
+        falls back to "numpy" if Numba is not installed
+        :param seed: seed of the simulation random generator, runs with equal seeds are reproducible
+        :param bonds: (B, 2) pairs of the spring particles ids connected by the springs,
+        the particles are split into dimers by default (see dimer_bonds, chain_bonds)
+        :param integrator: "euler" - the spring kick is followed by the drift (first order),
+        "verlet" - velocity Verlet: half kicks of the spring force before and after the drift (second order,
+        symplectic), the collisions are resolved between the first half kick and the drift
+        :param dt: time step
+        :param fix_energy: rescale the bath velocities every 5 frames to keep the full energy constant,
+        the collisions and the walls conserve it, but the spring integration and the time step do not exactly
+        (see equivalence.py energy)
+        :param dtype: "float64" or "float32" - float type of the positions, velocities and masses,
+        "float32" also makes the particle indexes int32. The energies are always accumulated in float64
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"dtype must be one of {tuple(self.DTYPES)}")
+        self._dtype = np.dtype(dtype)
+        self._index_dtype = np.dtype(self.DTYPES[dtype])
+        self._bonds = Simulation._check_bonds(Simulation.dimer_bonds(spring_cnt) if bonds is None else bonds,
+                                              spring_cnt)
+        self._rng = np.random.default_rng(seed)
         self._k_boltz = 1.380 * 1e-2
         self._gamma = gamma
         self._k = k
         self._l_0 = l_0
         self._R = R
         self._R_spring = R_spring
-        r = np.random.uniform(size=(2, particles_cnt))
-        r_spring = Simulation._sample_r_sping(spring_cnt, k, self._k_boltz, l_0, gamma, T)
-        self._r = np.hstack([r_spring, r])
-        v = stats.norm.rvs(loc=0.0, scale=np.sqrt(self._k_boltz*T / m), size=(2, particles_cnt))
-        v_spring = stats.norm.rvs(loc=0.0, scale=np.sqrt(self._k_boltz * T / m_spring), size=(2, spring_cnt))
-        self._v = np.hstack([v_spring, v])
-        self._m = np.hstack([m_spring, m])
+        r = self._rng.uniform(size=(2, particles_cnt))
+        r_spring = Simulation._sample_r_sping(spring_cnt, k, self._k_boltz, l_0, gamma, T, self._rng, self._bonds)
+        self._r = np.hstack([r_spring, r], dtype=self._dtype)
+        v = stats.norm.rvs(loc=0.0, scale=np.sqrt(self._k_boltz*T / m), size=(2, particles_cnt),
+                           random_state=self._rng)
+        v_spring = stats.norm.rvs(loc=0.0, scale=np.sqrt(self._k_boltz * T / m_spring), size=(2, spring_cnt),
+                                  random_state=self._rng)
+        self._v = np.hstack([v_spring, v], dtype=self._dtype)
+        self._m = np.hstack([m_spring, m], dtype=self._dtype)
         self._n_particles = particles_cnt
         self._n_spring = spring_cnt
 
-        self._init_ids_pairs()
+        self.contact_mode = contact_mode
+        self.backend = backend
+        self.integrator = integrator
+        self.dt = dt
+        self._fix_energy_on = fix_energy
 
-        self._potential_energy = []
-        self._kinetic_energy = []
+        self._potential_energy = RunningStats(self.ENERGY_WINDOW)
+        self._kinetic_energy = RunningStats(self.ENERGY_WINDOW)
 
         self._E_full = self.calc_full_energy()
         self._T_tar = self.T
         self._frame_no = 1
+        self._workspace = None
+        # TrajectoryRecorder that is called after every step
+        self.recorder = None
+        # PhaseStats of the steps, the timing is skipped while it's None, see profile()
+        self.phase_stats = None
 
-    def _init_ids_pairs(self):
-        spring_ids = np.arange(self._n_spring)
-        self._spring_ids_pairs = np.asarray(list(itertools.combinations(spring_ids, 2)))
-
-        particles_ids = np.arange(self._n_particles) + self._n_spring
-        self._particles_ids_pairs = np.asarray(list(itertools.combinations(particles_ids, 2)))
-
-        self._spring_particles_ids_paris = np.asarray(list(itertools.product(spring_ids, particles_ids)))
-
-        self._available_spring_ids_pairs = self._spring_ids_pairs.copy()
-        self._available_particles_ids_pairs = self._particles_ids_pairs.copy()
-        self._available_spring_particles_ids_paris = self._spring_particles_ids_paris.copy()
+    def _reset_contacts(self):
+        # Pairs that were in contact on the previous step, they are not collided again
+        # until they have been apart for at least one step
+        self._last_ic = np.zeros((0, 2), dtype=self._index_dtype)
 
     @staticmethod
-    def _sample_r_sping(spring_cnt: int, k: float, k_boltz: float, l_0: float, gamma: float, T: float):
-        assert spring_cnt == 2, "Not implemented"
-
-        def f(l):
-            return np.exp(-k * (np.abs(l - l_0) ** (gamma + 1)) / (2 * k_boltz * T * (gamma + 1)))
+    def dimer_bonds(spring_cnt: int) -> ndarray:
+        """
+        :return: bonds of the independent dimers (0, 1), (2, 3), ...
+        """
+        if spring_cnt % 2:
+            raise ValueError("spring_cnt of the dimers must be even")
+        return np.arange(spring_cnt).reshape(-1, 2)
 
-        r_sp = np.linspace(0, 0.5, num=10_000)
-        F = integrate.cumulative_trapezoid(y=f(r_sp), x=r_sp, initial=0)
-        const = F[-1]
-        F /= const
+    @staticmethod
+    def chain_bonds(spring_cnt: int) -> ndarray:
+        """
+        :return: bonds of the chain (0, 1), (1, 2), ...
+        """
+        ids = np.arange(spring_cnt)
+        return np.stack([ids[:-1], ids[1:]], axis=1)
 
-        print(f"{f(0.5)=}\t{f(1.0)=}")
+    @staticmethod
+    def _check_bonds(bonds: ndarray, spring_cnt: int) -> ndarray:
+        bonds = np.asarray(bonds, dtype=int).reshape(-1, 2)
+        if not bonds.shape[0]:
+            raise ValueError("at least one bond is required")
+        if bonds.min() < 0 or bonds.max() >= spring_cnt or np.any(bonds[:, 0] == bonds[:, 1]):
+            raise ValueError("bonds must connect two different spring particles")
+        return bonds
 
-        un = np.random.rand(1)
-        l_between = r_sp[bisect_left(F, un)]
+    @staticmethod
+    def _sample_r_sping(spring_cnt: int, k: float, k_boltz: float, l_0: float, gamma: float, T: float,
+                        rng: np.random.Generator = None, bonds: ndarray = None):
+        """
+        Samples the bond lengths from the equilibrium distribution, the bonded particles are placed one by one
+        at the sampled distance from the already placed ones. The first particle is placed in the center,
+        the first particles of the other connected components are placed uniformly
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        if bonds is None:
+            bonds = Simulation.dimer_bonds(spring_cnt)
+        lengths = Simulation.sample_spring_lengths(bonds.shape[0], k, k_boltz, l_0, gamma, T, rng)
+
+        r = np.full((spring_cnt, 2), np.nan)
+        placed = np.zeros(spring_cnt, dtype=bool)
+        for (i, j), l_between in zip(bonds, lengths):
+            if placed[j] and not placed[i]:
+                i, j = j, i
+            if not placed[i]:
+                r[i] = [0.5, 0.5] if not placed.any() else rng.uniform(0.1, 0.9, size=2)
+                placed[i] = True
+            if placed[j]:
+                continue
+
+            # The chain is kept inside the box
+            for _ in range(100):
+                phi = rng.random() * 2*np.pi
+                r[j] = r[i] + l_between * np.array([np.cos(phi), np.sin(phi)])
+                if np.all((r[j] >= 0) & (r[j] <= 1)):
+                    break
+            placed[j] = True
+
+        # Particles without bonds
+        r[~placed] = rng.uniform(size=(int(np.sum(~placed)), 2))
+        return r.T
 
-        print(f"{l_between=}")
+    @staticmethod
+    def sample_spring_lengths(size: int, k: float, k_boltz: float, l_0: float, gamma: float, T: float,
+                              rng: np.random.Generator = None) -> ndarray:
+        """
+        Draws size spring lengths from the equilibrium distribution by the inverse transform
+        of the tabulated CDF, the tables are cached for the recent parameters
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        r_sp, F = _spring_length_cdf(float(k), float(k_boltz), float(l_0), float(gamma), float(T))
+        return r_sp[np.searchsorted(F, rng.random(size))]
 
-        r_0 = np.array([0.5, 0.5])
-        phi = np.random.rand() * 2*np.pi
-        r_1 = r_0 + l_between * np.array([np.cos(phi), np.sin(phi)])
+    @classmethod
+    def from_params(cls, params: dict, l_0: float, R_size: float, R_mass: float, spring_cnt: int = 2, **kwargs):
+        """
+        Creates simulation from the demo parameters
+        :param params: dict with the keys of "par4sim" config record: R, T, r, k, gamma, m_spring
+        :param l_0: "l_0" config record
+        :param R_size: "R_size" config record, size of the bath particles
+        :param R_mass: "R_mass" config record, mass of the bath particles
+        :param kwargs: other arguments of the constructor
+        """
+        return cls(
+            gamma=params['gamma'], k=params['k'], l_0=l_0, R=R_size, R_spring=R_size * params['R'],
+            particles_cnt=params['r'], spring_cnt=spring_cnt,
+            T=params['T'],
+            m=np.full((params['r'], ), R_mass), m_spring=np.full((spring_cnt, ), R_mass * params['m_spring']),
+            **kwargs
+        )
 
-        return np.vstack([r_0, r_1]).T
+    def to_params(self, R_mass: float) -> dict:
+        """
+        Inverse of from_params
+        :param R_mass: "R_mass" config record, mass of the bath particles
+        :return: demo parameters R, T, r, k, gamma, m_spring of the current state, T is the target temperature
+        """
+        return dict(R=self._R_spring / self._R, T=float(self._T_tar), r=int(self._n_particles), k=self._k,
+                    gamma=self._gamma, m_spring=float(self.m_spring[0]) / R_mass)
 
     def __iter__(self):
         return self
 
     def __next__(self) -> Tuple[ndarray, ndarray, ndarray, ndarray, float]:
-        f = self.motion(dt=0.00001)
+        """
+        :return: copies of r, r_spring, v, v_spring after the step and f @ dr of the step
+        """
+        f = self._step()[0]
+        return self.r.copy(), self.r_spring.copy(), self.v.copy(), self.v_spring.copy(), f
+
+    def _step(self) -> Tuple[float, float, float]:
+        """
+        :return: f @ dr, kinetic and potential energies of the step
+        """
+        stats = self.phase_stats
+        f = self.motion(dt=self._dt)
         self._frame_no = (self._frame_no + 1) % 5
+        if stats is not None:
+            stats.steps += 1
+            t = stats.start()
 
-        self._potential_energy.append(self.calc_potential_energy())
-        self._kinetic_energy.append(self.calc_kinetic_energy())
+        potential, kinetic = self.calc_potential_energy(), self.calc_kinetic_energy()
+        self._potential_energy.push(potential)
+        self._kinetic_energy.push(kinetic)
+        if stats is not None:
+            t = stats.lap("energy", t)
 
-        if self._frame_no == 0:
+        if self._frame_no == 0 and self._fix_energy_on:
             self._fix_energy()
+            if stats is not None:
+                t = stats.lap("fix_energy", t)
 
-        # with open("E_dump.txt", "a") as fl:
-        #     print(f"{self.calc_full_energy():.4f}", file=fl)
-        #
-        # with open("T_dump.txt", "a") as fl:
-        #     print(f"{self.T:5.2f}", file=fl)
+        if self.recorder is not None:
+            self.recorder.record(self, f, kinetic, potential)
+            if stats is not None:
+                stats.lap("record", t)
 
-        return self.r, self.r_spring, self.v, self.v_spring, f
+        return f, kinetic, potential
+
+    def step_many(self, n: int, record_every: int = 1, frames_c: Union[int, None] = None) -> Observables:
+        """
+        Advances the simulation by n steps in one call, the observables are recorded after every
+        record_every-th step into preallocated arrays
+        :param frames_c: averaging window of the mean energies, see mean_kinetic_energy
+        :return: n // record_every records
+        """
+        if n < 0 or record_every < 1:
+            raise ValueError("n must be >= 0 and record_every must be > 0")
+        records = n // record_every
+        obs = Observables(*np.empty((len(Observables._fields), records)))
+        step = self._step
+        for i in range(records):
+            for _ in range(record_every - 1):
+                step()
+            obs.force[i], obs.kinetic[i], obs.potential[i] = step()
+            obs.mean_kinetic[i] = self._kinetic_energy.mean(frames_c)
+            obs.mean_potential[i] = self._potential_energy.mean(frames_c)
+            obs.full_energy[i] = self.calc_full_energy()
+        for _ in range(n - records * record_every):
+            step()
+        return obs
+
+    @contextmanager
+    def profile(self, stats: PhaseStats = None):
+        """
+        Times the phases of the steps made inside the with block:
+        with simulation.profile() as stats: ...; print(stats.report())
+        :param stats: PhaseStats to accumulate into, a new one by default
+        """
+        previous = self.phase_stats
+        self.phase_stats = PhaseStats() if stats is None else stats
+        try:
+            yield self.phase_stats
+        finally:
+            self.phase_stats = previous
 
     @property
     def T(self) -> float:
-        return np.mean(((np.linalg.norm(self._v, axis=0) ** 2) * self._m)) / (2 * self._k_boltz)
+        return np.mean(((np.linalg.norm(self._v, axis=0) ** 2) * self._m), dtype=float) / (2 * self._k_boltz)
 
     @T.setter
     def T(self, val: float):
@@ -136,6 +333,63 @@ class Simulation:
         self._l_0 = val
         self._E_full = self.calc_full_energy()
 
+    @property
+    def bonds(self) -> ndarray:
+        return self._bonds
+
+    @property
+    def dtype(self) -> str:
+        return self._dtype.name
+
+    @property
+    def dt(self) -> float:
+        return self._dt
+
+    @dt.setter
+    def dt(self, val: float):
+        if val <= 0:
+            raise ValueError("dt must be > 0")
+        self._dt = val
+
+    @property
+    def integrator(self) -> str:
+        return self._integrator
+
+    @integrator.setter
+    def integrator(self, val: str):
+        if val not in self.INTEGRATORS:
+            raise ValueError(f"integrator must be one of {self.INTEGRATORS}")
+        self._integrator = val
+
+    @property
+    def contact_mode(self) -> str:
+        return self._contact_mode
+
+    @contact_mode.setter
+    def contact_mode(self, val: str):
+        if val not in self.CONTACT_MODES:
+            raise ValueError(f"contact_mode must be one of {self.CONTACT_MODES}")
+        self._contact_mode = val
+        self._reset_contacts()
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    @backend.setter
+    def backend(self, val: str):
+        if val not in self.BACKENDS:
+            raise ValueError(f"backend must be one of {self.BACKENDS}")
+        self._kernels = None
+        if val == "numba":
+            try:
+                import numba_kernels
+                self._kernels = numba_kernels
+            except ImportError:
+                warnings.warn("Numba is not installed, the numpy backend is used")
+                val = "numpy"
+        self._backend = val
+
     @property
     def R(self) -> float:
         return self._R
@@ -154,6 +408,10 @@ class Simulation:
 
     @property
     def r(self) -> ndarray:
+        """
+        Live view of the state, the same as r_spring, v and v_spring: the steps update the state in place,
+        so the view changes with them. A snapshot must be copied
+        """
         return self._r[:, self._n_spring:]
 
     @property
@@ -194,84 +452,420 @@ class Simulation:
         return v1new, v2new
 
     @staticmethod
-    def _update_available(arr: ndarray, sub_arr: ndarray) -> ndarray:
-        eq_mat = sub_arr.T[None, ...] == arr[..., None]
-        na_idx = np.any(np.all(eq_mat, axis=1), axis=1)
-        return arr[~na_idx, :]
-
-    def motion(self, dt) -> float:
-        if self._available_spring_ids_pairs.shape[0]:
-            ic_spring = self._available_spring_ids_pairs[
-                np.array([self.get_deltad2_pairs(self._r, self._available_spring_ids_pairs)])
-                < (2 * self.R_spring) ** 2]
-        else:
-            ic_spring = np.zeros((0, 2), dtype=int)
+    def _spring_contact_pairs(r: ndarray, n_spring: int, R: float, R_spring: float,
+                              index_dtype: type = np.intp) -> Tuple[ndarray, ndarray]:
+        """
+        Spring particles are checked against all the others directly, there are only a few of them,
+        so it is cheaper than binning them into a grid (same as numba_kernels.find_contacts)
+        :param r: positions of all the particles, the spring particles go first
+        :return: pairs of the spring particles and pairs (spring particle, bath particle) in contact,
+        indexes into r sorted lexicographically
+        """
+        d2 = (r[0, :n_spring, None] - r[0]) ** 2 + (r[1, :n_spring, None] - r[1]) ** 2
+        spring = np.triu(d2[:, :n_spring] < (2 * R_spring) ** 2, 1)
+        ic_spring = np.argwhere(spring).astype(index_dtype, copy=False)
+        ic_spring_particles = np.argwhere(d2[:, n_spring:] < (R + R_spring) ** 2).astype(index_dtype, copy=False)
+        ic_spring_particles[:, 1] += n_spring
+        return ic_spring, ic_spring_particles
 
-        if self._available_particles_ids_pairs.shape[0]:
-            ic_particles = self._available_particles_ids_pairs[
-                self.get_deltad2_pairs(self._r, self._available_particles_ids_pairs) < (2 * self.R) ** 2]
+    @staticmethod
+    def get_contact_pairs(r_a: ndarray, r_b: ndarray, cutoff: float, same: bool = False,
+                          groups_a: ndarray = None, groups_b: ndarray = None,
+                          workspace: "_Workspace" = None, index_dtype: type = np.intp) -> ndarray:
+        """
+        Uniform-grid (cell-list) broad phase: particles are binned into square cells with side >= cutoff,
+        so only the particles in the same or the neighbouring cells are checked,
+        up to DIRECT_PAIRS candidate pairs all of them are checked directly
+        :param same: if same then r_a and r_b are the same set and only pairs with i < j are returned
+        :param groups_a: optional ids of independent groups (replicas) of r_a, only particles of the same group
+        can be in contact
+        :param groups_b: ids of groups of r_b, must be passed together with groups_a unless same
+        :param workspace: _Workspace of at least r_b size, the cells of r_b and the grid counts are kept in its
+        buffers, it does not save time, but the step allocates no arrays of the grid size (~1 MB at cutoff 0.004)
+        :param index_dtype: integer type of the returned pairs, the cells are always indexed by intp
+        :return: pairs (i, j) of indexes into r_a and r_b with distance < cutoff, sorted lexicographically
+        """
+        if r_a.shape[1] * r_b.shape[1] <= Simulation.DIRECT_PAIRS:
+            d2 = (r_a[0][:, None] - r_b[0]) ** 2 + (r_a[1][:, None] - r_b[1]) ** 2
+            close = d2 < cutoff ** 2
+            if same:
+                close = np.triu(close, 1)
+                groups_b = groups_a
+            if groups_a is not None:
+                close &= groups_a[:, None] == groups_b
+            return np.argwhere(close).astype(index_dtype, copy=False)
+
+        # Zero cutoff (zero radii) finds no pairs, a single cell avoids the division by zero
+        n_cells = int(min(max(1 / cutoff, 1), 1024)) if cutoff > 0 else 1
+        # Border cells are always empty, so neighbour lookups never leave the grid (or the group)
+        side = n_cells + 2
+
+        def cells_ids(r, groups, workspace=None):
+            if workspace is not None and groups is None:
+                tmp, cells, ids = workspace.part(r.shape[1])
+                np.multiply(r, n_cells, out=tmp)
+                np.floor(tmp, out=tmp)
+                np.copyto(cells, tmp, casting='unsafe')
+                np.clip(cells, 0, n_cells - 1, out=cells)
+                cells += 1
+                np.multiply(cells[0], side, out=ids)
+                ids += cells[1]
+                return ids
+            cells = np.clip(np.floor(r * n_cells).astype(int), 0, n_cells - 1) + 1
+            ids = cells[0] * side + cells[1]
+            return ids if groups is None else ids + groups * (side * side)
+
+        if same:
+            groups_b = groups_a
+        n_groups = 1 if groups_a is None else int(max(groups_a.max(initial=0), groups_b.max(initial=0))) + 1
+        cells_b = cells_ids(r_b, groups_b, workspace)
+        cells_a = cells_b if same else cells_ids(r_a, groups_a)
+        order_b = np.argsort(cells_b, kind='stable').astype(index_dtype, copy=False)
+        if workspace is not None and groups_b is None:
+            counts_b, starts_b = workspace.grid(side * side)
+            counts_b.fill(0)
+            np.add.at(counts_b, cells_b, 1)
+            np.cumsum(counts_b, out=starts_b)
+            starts_b -= counts_b
         else:
-            ic_particles = np.zeros((0, 2), dtype=int)
+            counts_b = np.bincount(cells_b, minlength=side * side * n_groups)
+            starts_b = np.cumsum(counts_b) - counts_b
+        arange_a = workspace.arange[:cells_a.shape[0]] if workspace is not None and workspace.n >= cells_a.shape[0] \
+            else np.arange(cells_a.shape[0], dtype=index_dtype)
+
+        ids_a, ids_b = [], []
+        for offset in (-side - 1, -side, -side + 1, -1, 0, 1, side - 1, side, side + 1):
+            neighbours = cells_a + offset
+            cnt = counts_b[neighbours]
+            total = cnt.sum()
+            if not total:
+                continue
+            first = np.cumsum(cnt) - cnt
+            ids_a.append(np.repeat(arange_a, cnt))
+            ids_b.append(order_b[np.repeat(starts_b[neighbours] - first, cnt) + np.arange(total)])
+
+        if not ids_a:
+            return np.zeros((0, 2), dtype=index_dtype)
+        ids_a, ids_b = np.concatenate(ids_a), np.concatenate(ids_b)
+        if same:
+            upper = ids_a < ids_b
+            ids_a, ids_b = ids_a[upper], ids_b[upper]
+
+        d2 = (r_a[0][ids_a] - r_b[0][ids_b]) ** 2 + (r_a[1][ids_a] - r_b[1][ids_b]) ** 2
+        close = d2 < cutoff ** 2
+        ids_a, ids_b = ids_a[close], ids_b[close]
+        order = np.argsort(ids_a.astype(np.int64, copy=False) * r_b.shape[1] + ids_b)
+        return np.stack([ids_a[order], ids_b[order]], axis=1)
 
-        if self._available_spring_particles_ids_paris.shape[0]:
-            ic_spring_particles = self._available_spring_particles_ids_paris[
-                self.get_deltad2_pairs(self._r, self._available_spring_particles_ids_paris) < (self.R + self.R_spring) ** 2]
-        else:
-            ic_spring_particles = np.zeros((0, 2), dtype=int)
+    @staticmethod
+    def _exclude_pairs(arr: ndarray, sub_arr: ndarray, n: int) -> ndarray:
+        if not (arr.shape[0] and sub_arr.shape[0]):
+            return arr
+        # int64 keys, so the compact int32 indexes never overflow
+        na_idx = np.isin(arr[:, 0].astype(np.int64) * n + arr[:, 1], sub_arr[:, 0].astype(np.int64) * n + sub_arr[:, 1])
+        return arr[~na_idx, :]
 
-        self._available_spring_ids_pairs = self._update_available(
-            self._spring_ids_pairs, ic_spring
-        )
+    @staticmethod
+    def _collision_rounds(ic: ndarray, n: int) -> Tuple[ndarray, list]:
+        """
+        A particle can be in several pairs of one step, a vectorized update of such pairs keeps only the last
+        velocity of the particle and loses momentum and energy. The pairs are split into rounds without common
+        particles: resolving the rounds one after another is the same as resolving the pairs one after another
+        in the order of ic
+        :return: pairs without particles in common with the other pairs and the rounds of the rest of the pairs
+        """
+        counts = np.bincount(ic.ravel(), minlength=n)
+        shared = (counts[ic[:, 0]] > 1) | (counts[ic[:, 1]] > 1)
+        if not shared.any():
+            return ic, []
+        # First round every particle is free in
+        free = {}
+        rounds = []
+        for p, (i, j) in zip(np.flatnonzero(shared).tolist(), ic[shared].tolist()):
+            k = max(free.get(i, 0), free.get(j, 0))
+            if k == len(rounds):
+                rounds.append([])
+            rounds[k].append(p)
+            free[i] = free[j] = k + 1
+        return ic[~shared], [ic[ids] for ids in rounds]
+
+    def _spring_force(self) -> Tuple[ndarray, ndarray]:
+        """
+        :return: forces acting on the first particles of the bonds (with minus sign) and the vectors between
+        the bonded particles, both of shape (2, B)
+        """
+        dr = self._r[:, self._bonds[:, 0]] - self._r[:, self._bonds[:, 1]]
+        dr_sc = np.linalg.norm(dr, axis=0)
+        dx = dr * (1 - self.l_0 / dr_sc)
+        dx_norm = np.abs(dr_sc - self.l_0)
+        f = (self._k * (dx_norm ** (self._gamma - 1))) * dx
+        return f, dr
 
-        self._available_particles_ids_pairs = self._update_available(
-            self._particles_ids_pairs, ic_particles
-        )
+    def _spring_kick(self, dt: float) -> float:
+        """
+        Kicks the velocities of the bonded particles by the spring forces, a particle of several bonds
+        gets the sum of their forces
+        :return: sum of f @ dr over the bonds
+        """
+        f, dr = self._spring_force()
+        i, j = self._bonds[:, 0], self._bonds[:, 1]
+        np.subtract.at(self._v, (slice(None), i), f * (dt / self._m[i]))
+        np.add.at(self._v, (slice(None), j), f * (dt / self._m[j]))
+        return float(np.sum(f * dr))
 
-        self._available_spring_particles_ids_paris = self._update_available(
-            self._spring_particles_ids_paris, ic_spring_particles
-        )
+    def motion(self, dt) -> float:
+        """
+        Advances the simulation by dt, the positions and velocities are updated in place
+        :return: f @ dr of the spring
+        """
+        if self._kernels is not None:
+            return self._motion_compiled(dt)
+
+        ws = self._workspace
+        if ws is None or ws.n != self._r.shape[1]:
+            ws = self._workspace = _Workspace(self._r.shape[1], self._dtype, self._index_dtype)
+        stats = self.phase_stats
+        if stats is not None:
+            t = stats.start()
+
+        verlet = self._integrator == "verlet"
+        if verlet:
+            self._spring_kick(dt / 2)
+            if stats is not None:
+                t = stats.lap("spring", t)
+
+        idx = self._index_dtype
+        ic_spring, ic_spring_particles = self._spring_contact_pairs(self._r, self._n_spring, self.R, self.R_spring,
+                                                                    index_dtype=idx)
+        ic_particles = self.get_contact_pairs(self.r, self.r, 2 * self.R, same=True, workspace=ws, index_dtype=idx)
+        ic_particles += self._n_spring
 
         ic = np.vstack([
             ic_spring,
             ic_particles,
             ic_spring_particles
         ])
-        # print(f"DEBUG: {ic.shape}")
-
-        self._v[:, ic[:, 0]], self._v[:, ic[:, 1]] = self.compute_new_v(
-            self._v[:, ic[:, 0]], self._v[:, ic[:, 1]],
-            self._r[:, ic[:, 0]], self._r[:, ic[:, 1]],
-            self._m[ic[:, 0]], self._m[ic[:, 1]]
+        if stats is not None:
+            t = stats.lap("contacts", t)
+            contacts = ic.shape[0]
+        if self._contact_mode == "approaching":
+            ic = ic[ws.approaching(self._r, self._v, ic)]
+        else:
+            ic = self._exclude_pairs(ic, self._last_ic, self._r.shape[1])
+            self._last_ic = ic
+        if stats is not None:
+            t = stats.lap("filter", t)
+            stats.add_contacts(contacts, ic.shape[0])
+
+        ws.collide(self._r, self._v, self._m, ic, self._contact_mode == "approaching")
+        if stats is not None:
+            t = stats.lap("collide", t)
+
+        if verlet:
+            np.multiply(self._v, dt, out=ws.tmp)
+            self._r += ws.tmp
+            if stats is not None:
+                t = stats.lap("drift", t)
+            # The particles that have crossed a wall are mirrored back, so the reflection is exact
+            # and the spring force is never evaluated outside the box
+            np.greater(self._r, 1, out=ws.mask)
+            np.subtract(2, self._r, out=self._r, where=ws.mask)
+            np.negative(self._v, out=self._v, where=ws.mask)
+            np.less(self._r, 0, out=ws.mask)
+            np.negative(self._r, out=self._r, where=ws.mask)
+            np.negative(self._v, out=self._v, where=ws.mask)
+            if stats is not None:
+                t = stats.lap("walls", t)
+            f = self._spring_kick(dt / 2)
+            if stats is not None:
+                stats.lap("spring", t)
+            return f
+
+        f = self._spring_kick(dt)
+        if stats is not None:
+            t = stats.lap("spring", t)
+
+        # Reflection from the walls: masks of the two sides are disjoint
+        np.abs(self._v, out=ws.tmp)
+        np.greater(self._r, 1, out=ws.mask)
+        np.negative(ws.tmp, out=self._v, where=ws.mask)
+        np.less(self._r, 0, out=ws.mask)
+        np.copyto(self._v, ws.tmp, where=ws.mask)
+        if stats is not None:
+            t = stats.lap("walls", t)
+
+        np.multiply(self._v, dt, out=ws.tmp)
+        self._r += ws.tmp
+        if stats is not None:
+            stats.lap("drift", t)
+
+        return f
+
+    def _motion_compiled(self, dt) -> float:
+        kernels = self._kernels
+        stats = self.phase_stats
+        if stats is not None:
+            t = stats.start()
+        verlet = self._integrator == "verlet"
+        spring_args = (self._r, self._v, self._m, self._bonds, self._k, self._gamma, self.l_0)
+        if verlet:
+            kernels.spring_kick(*spring_args, dt / 2)
+            if stats is not None:
+                t = stats.lap("spring", t)
+
+        ic = kernels.find_contacts(self._r, self._n_spring, self.R, self.R_spring, self._index_dtype)
+        if stats is not None:
+            t = stats.lap("contacts", t)
+            contacts = ic.shape[0]
+        if self._contact_mode == "approaching":
+            ic = kernels.approaching_pairs(ic, self._r, self._v)
+        else:
+            ic = kernels.exclude_pairs(ic, self._last_ic, self._r.shape[1])
+            self._last_ic = ic
+        if stats is not None:
+            t = stats.lap("filter", t)
+            stats.add_contacts(contacts, ic.shape[0])
+
+        kernels.collide(self._r, self._v, self._m, ic, self._contact_mode == "approaching")
+        if stats is not None:
+            t = stats.lap("collide", t)
+        if verlet:
+            kernels.drift(self._r, self._v, dt)
+            if stats is not None:
+                t = stats.lap("drift", t)
+            kernels.mirror_walls(self._r, self._v)
+            if stats is not None:
+                t = stats.lap("walls", t)
+            f = kernels.spring_kick(*spring_args, dt / 2)
+            if stats is not None:
+                stats.lap("spring", t)
+            return f
+
+        f = kernels.spring_kick(*spring_args, dt)
+        if stats is not None:
+            t = stats.lap("spring", t)
+        kernels.reflect_walls(self._r, self._v)
+        if stats is not None:
+            t = stats.lap("walls", t)
+        kernels.drift(self._r, self._v, dt)
+        if stats is not None:
+            stats.lap("drift", t)
+        return f
+
+    def _get_state(self) -> Tuple[dict, dict]:
+        """
+        :return: scalar parameters and arrays of the full simulation state
+        """
+        scalars = dict(
+            k_boltz=self._k_boltz, gamma=self._gamma, k=self._k, l_0=self._l_0, R=self._R, R_spring=self._R_spring,
+            n_particles=int(self._n_particles), n_spring=int(self._n_spring),
+            contact_mode=self._contact_mode, backend=self._backend,
+            integrator=self._integrator, fix_energy=self._fix_energy_on, dtype=self._dtype.name,
+            E_full=float(self._E_full), T_tar=float(self._T_tar), dt=self._dt, frame_no=int(self._frame_no),
+            rng=self._rng.bit_generator.state,
+        )
+        arrays = dict(
+            r=self._r, v=self._v, m=self._m, last_ic=self._last_ic, bonds=self._bonds,
+        )
+        for name, stats in (("potential", self._potential_energy), ("kinetic", self._kinetic_energy)):
+            arrays.update({f"{name}_{key}": arr for key, arr in stats.state().items()})
+        return scalars, arrays
+
+    def _set_state(self, scalars: dict, arrays: dict):
+        self._k_boltz, self._gamma, self._k = scalars['k_boltz'], scalars['gamma'], scalars['k']
+        self._l_0, self._R, self._R_spring = scalars['l_0'], scalars['R'], scalars['R_spring']
+        self._n_particles, self._n_spring = scalars['n_particles'], scalars['n_spring']
+        self._E_full, self._T_tar = scalars['E_full'], scalars['T_tar']
+        self._dt, self._frame_no = scalars['dt'], scalars['frame_no']
+        self._rng = np.random.default_rng()
+        self._rng.bit_generator.state = scalars['rng']
+        self._contact_mode = scalars['contact_mode']
+        self._integrator, self._fix_energy_on = scalars['integrator'], scalars['fix_energy']
+        self._dtype = np.dtype(scalars['dtype'])
+        self._index_dtype = np.dtype(self.DTYPES[scalars['dtype']])
+        self.backend = scalars['backend']
+        self.recorder = None
+        self.phase_stats = None
+        self._workspace = None
+
+        self._r, self._v, self._m = arrays['r'], arrays['v'], arrays['m']
+        self._last_ic = arrays['last_ic'].astype(self._index_dtype, copy=False)
+        self._bonds = np.array(arrays['bonds'])
+        self._potential_energy, self._kinetic_energy = (
+            RunningStats.from_state({key[len(name) + 1:]: arr for key, arr in arrays.items()
+                                     if key.startswith(name + "_")})
+            for name in ("potential", "kinetic")
         )
 
-        dr = self.r_spring[:, 0] - self.r_spring[:, 1]
-        dr_sc = np.linalg.norm(dr)
-        dx = dr * (1 - self.l_0 / dr_sc)
-        dx_norm = np.abs(dr_sc - self.l_0)
-        f = (self._k * (dx_norm ** (self._gamma - 1))) * dx
-        self.v_spring[:, 0] -= f * (dt / self.m_spring[0])
-        self.v_spring[:, 1] += f * (dt / self.m_spring[1])
-
-        self._v[0, self._r[0] > 1] = -np.abs(self._v[0, self._r[0] > 1])
-        self._v[0, self._r[0] < 0] = np.abs(self._v[0, self._r[0] < 0])
-        self._v[1, self._r[1] > 1] = -np.abs(self._v[1, self._r[1] > 1])
-        self._v[1, self._r[1] < 0] = np.abs(self._v[1, self._r[1] < 0])
-
-        self._r = self._r + self._v * dt
-
-        return f @ dr
+    def save(self, path: str):
+        """
+        Saves a binary snapshot of the full simulation state, the previous file is replaced atomically
+        """
+        scalars, arrays = self._get_state()
+        header = {"class": type(self).__name__, "scalars": scalars, "arrays": {}}
+        size = 0
+        for name, arr in arrays.items():
+            header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": size}
+            size += _align(arr.nbytes)
+        header = json.dumps(header).encode("utf-8")
+        data_start = _align(len(_SNAPSHOT_MAGIC) + 8 + len(header))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_SNAPSHOT_MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            offset = data_start
+            for arr in arrays.values():
+                f.seek(offset)
+                f.write(np.ascontiguousarray(arr).tobytes())
+                offset += _align(arr.nbytes)
+            f.truncate(data_start + size)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, seed: Union[int, np.random.SeedSequence, None] = None):
+        """
+        Restores the simulation saved by save(). The arrays are memory-mapped copy-on-write,
+        so the file is read lazily and never modified
+        :param seed: if seed is not None then the random generator is reseeded instead of being restored,
+        it allows to fork many independent runs from one state
+        """
+        with open(path, "rb") as f:
+            if f.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a simulation snapshot")
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if header["class"] != cls.__name__:
+            raise ValueError(f"snapshot of {header['class']} can't be loaded as {cls.__name__}")
+        data_start = _align(len(_SNAPSHOT_MAGIC) + 8 + header_len)
+
+        arrays = {}
+        for name, desc in header["arrays"].items():
+            shape = tuple(desc["shape"])
+            if 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=desc["dtype"])
+            else:
+                arrays[name] = np.asarray(np.memmap(path, dtype=desc["dtype"], mode="c", shape=shape,
+                                                    offset=data_start + desc["offset"]))
+
+        simulation = cls.__new__(cls)
+        simulation._set_state(header["scalars"], arrays)
+        if seed is not None:
+            simulation._rng = np.random.default_rng(seed)
+        return simulation
 
     def add_particles(self, r: ndarray, v: ndarray, m: ndarray):
         if (r.shape != v.shape) or (r.shape[0] != self._r.shape[0]) or (r.shape[1] != m.shape[0]):
             raise ValueError("Incorrect shape")
-        self._r = np.hstack([self._r, r])
-        self._v = np.hstack([self._v, v])
-        self._m = np.hstack([self._m, m])
+        self._r = np.hstack([self._r, r], dtype=self._dtype)
+        self._v = np.hstack([self._v, v], dtype=self._dtype)
+        self._m = np.hstack([self._m, m], dtype=self._dtype)
 
         self._E_full = self.calc_full_energy()
         self._T_tar = self.T
 
-        self._init_ids_pairs()
+        self._reset_contacts()
 
     def _set_particles_cnt(self, particles_cnt: int):
         if particles_cnt < 0:
@@ -285,14 +879,14 @@ class Simulation:
         if particles_cnt > self._n_particles:
             new_cnt = particles_cnt - self._n_particles
             self.add_particles(
-                r=np.random.uniform(size=(2, new_cnt)),
+                r=self._rng.uniform(size=(2, new_cnt)),
                 v=np.full(shape=(new_cnt, 2), fill_value=np.std(self.v, axis=1)).T,
                 m=np.full(shape=(new_cnt, ), fill_value=np.median(self.m))
             )
 
         if particles_cnt != self._n_particles:
             self._n_particles = particles_cnt
-            self._init_ids_pairs()
+            self._reset_contacts()
 
         self._E_full = self.calc_full_energy()
         self._T_tar = self.T
@@ -335,44 +929,194 @@ class Simulation:
         return float(self._k_boltz * self._T_tar)
 
     def calc_kinetic_energy(self) -> float:
-        return np.mean((np.linalg.norm(self.v_spring, axis=0) ** 2) * self.m_spring) / 2
+        return np.mean((np.linalg.norm(self.v_spring, axis=0) ** 2) * self.m_spring, dtype=float) / 2
 
     def calc_full_kinetic_energy(self):
-        E_spring = np.sum((np.linalg.norm(self.v_spring, axis=0) ** 2) * self.m_spring) / 2
-        E_particles = np.sum((np.linalg.norm(self.v, axis=0) ** 2) * self.m) / 2
+        E_spring = np.sum((np.linalg.norm(self.v_spring, axis=0) ** 2) * self.m_spring, dtype=float) / 2
+        E_particles = np.sum((np.linalg.norm(self.v, axis=0) ** 2) * self.m, dtype=float) / 2
         return float(E_spring + E_particles)
 
-    def _fix_energy(self):
-        E_par = np.sum((np.linalg.norm(self.v, axis=0) ** 2) * self.m) / 2
-        beta = (self._E_full - 2 * self.calc_potential_energy() - self._n_spring*self.calc_kinetic_energy()) / E_par
+    def _fix_energy(self) -> float:
+        """
+        Rescales velocities of the bath particles to keep the full energy constant
+        :return: the velocities scale factor
+        """
+        E_par = np.sum((np.linalg.norm(self.v, axis=0) ** 2) * self.m, dtype=float) / 2
+        beta = (self._E_full - 2 * self.calc_full_potential_energy()
+                - self._n_spring*self.calc_kinetic_energy()) / E_par
         self._v[:, self._n_spring:] *= np.sqrt(beta)
+        return float(np.sqrt(beta))
         # print(f"DEBUG: {self._E_full - self.calc_full_energy()}")
 
     def calc_full_energy(self):
-        return self.calc_full_kinetic_energy() + 2 * self.calc_potential_energy()
+        return self.calc_full_kinetic_energy() + 2 * self.calc_full_potential_energy()
 
-    def calc_potential_energy(self) -> float:
-        dr = self.r_spring[:, 0] - self.r_spring[:, 1]
-        dr_sc = np.linalg.norm(dr)
+    def _bond_energies(self) -> ndarray:
+        dr = self._r[:, self._bonds[:, 0]] - self._r[:, self._bonds[:, 1]]
+        dr_sc = np.linalg.norm(dr, axis=0)
         dx_norm = np.abs(dr_sc - self.l_0)
         return self._k * (dx_norm ** (self._gamma + 1)) / (self._gamma + 1)
 
+    def calc_potential_energy(self) -> float:
+        """
+        :return: potential energy of one spring averaged over the bonds
+        """
+        return np.mean(self._bond_energies(), dtype=float)
+
+    def calc_full_potential_energy(self) -> float:
+        return np.sum(self._bond_energies(), dtype=float)
+
     def mean_potential_energy(self, frames_c: Union[int, None] = None) -> float:
         """
         :param frames_c: if frames_c is None then the averaging is taken over all frames,
-        otherwise the averaging is taken over the last frame_c frames
+        otherwise the averaging is taken over the last frame_c frames, frames_c <= ENERGY_WINDOW
         """
-        if frames_c is None:
-            return float(np.mean(self._potential_energy))
-        else:
-            return float(np.mean(self._potential_energy[-frames_c:]))
+        return self._potential_energy.mean(frames_c)
 
     def mean_kinetic_energy(self, frames_c: Union[int, None] = None) -> float:
         """
         :param frames_c: if frames_c is None then the averaging is taken over all frames,
-        otherwise the averaging is taken over the last frame_c frames
+        otherwise the averaging is taken over the last frame_c frames, frames_c <= ENERGY_WINDOW
         """
-        if frames_c is None:
-            return float(np.mean(self._kinetic_energy))
-        else:
-            return float(np.mean(self._kinetic_energy[-frames_c:]))
+        return self._kinetic_energy.mean(frames_c)
+
+
+class _Workspace:
+    """
+    Preallocated buffers of Simulation.motion, the per-particle ones are sized to n particles
+    and the per-pair ones grow geometrically with the number of the collided pairs
+    """
+
+    def __init__(self, n: int, dtype: np.dtype = np.float64, index_dtype: np.dtype = np.intp):
+        self.n = n
+        self.dtype = dtype
+        self.tmp = np.empty((2, n), dtype=dtype)
+        self.mask = np.empty((2, n), dtype=bool)
+        # The cells stay intp: ufunc.at and fancy indexing are much slower with the other index types
+        self._cells = np.empty((2, n), dtype=int)
+        self._cell_ids = np.empty(n, dtype=int)
+        self.arange = np.arange(n, dtype=index_dtype)
+        self._grid = np.empty((2, 0), dtype=int)
+        self._pairs_cap = 0
+        self._grow(64)
+
+    def _grow(self, k: int):
+        cap = max(k, 2 * self._pairs_cap)
+        self._pairs_cap = cap
+        self._pair_vecs = np.empty((5, 2, cap), dtype=self.dtype)
+        self._pair_scalars = np.empty((4, cap), dtype=self.dtype)
+        self._pair_mask = np.empty(cap, dtype=bool)
+
+    def part(self, n: int) -> Tuple[ndarray, ndarray, ndarray]:
+        """
+        :return: float (2, n), int (2, n) and int (n, ) buffers for the cells of n <= self.n particles
+        """
+        return self.tmp[:, :n], self._cells[:, :n], self._cell_ids[:n]
+
+    def grid(self, size: int) -> Tuple[ndarray, ndarray]:
+        """
+        :return: two int buffers of the cells counts and starts, they are reallocated only when the grid grows
+        """
+        if self._grid.shape[1] < size:
+            self._grid = np.empty((2, size), dtype=int)
+        return self._grid[0, :size], self._grid[1, :size]
+
+    def approaching(self, r: ndarray, v: ndarray, ic: ndarray) -> ndarray:
+        """
+        :return: mask of the pairs of ic that move towards each other
+        """
+        k = ic.shape[0]
+        if k > self._pairs_cap:
+            self._grow(k)
+        dr, dv, a, b, _ = self._pair_vecs[:, :, :k]
+        self._gather(r, ic, dr, a, b)
+        self._gather(v, ic, dv, a, b)
+        np.multiply(dv, dr, out=dv)
+        dot = self._pair_scalars[0, :k]
+        np.add(dv[0], dv[1], out=dot)
+        return np.less(dot, 0, out=self._pair_mask[:k])
+
+    @staticmethod
+    def _gather(x: ndarray, ic: ndarray, out: ndarray, a: ndarray, b: ndarray):
+        # out = x[:, i] - x[:, j]
+        np.take(x, ic[:, 0], axis=1, out=a, mode='clip')
+        np.take(x, ic[:, 1], axis=1, out=b, mode='clip')
+        np.subtract(a, b, out=out)
+
+    def collide(self, r: ndarray, v: ndarray, m: ndarray, ic: ndarray, approaching: bool = False):
+        """
+        Elastic collisions of the pairs ic, the same arithmetic as Simulation.compute_new_v.
+        The pairs sharing a particle are resolved one after another in the order of ic
+        :param approaching: a pair sharing a particle is collided only if it still moves towards each other
+        after the earlier collisions of its particles
+        """
+        single, rounds = Simulation._collision_rounds(ic, v.shape[1])
+        self._collide(r, v, m, single)
+        for pairs in rounds:
+            if approaching:
+                pairs = pairs[self.approaching(r, v, pairs)]
+            self._collide(r, v, m, pairs)
+
+    def _collide(self, r: ndarray, v: ndarray, m: ndarray, ic: ndarray):
+        # The pairs have no particles in common
+        k = ic.shape[0]
+        if k == 0:
+            return
+        if k > self._pairs_cap:
+            self._grow(k)
+        v1, v2, dr, dv, t = self._pair_vecs[:, :, :k]
+        m1, m2, m_s, dr_norm_sq = self._pair_scalars[:, :k]
+        i, j = ic[:, 0], ic[:, 1]
+        np.take(v, i, axis=1, out=v1, mode='clip')
+        np.take(v, j, axis=1, out=v2, mode='clip')
+        self._gather(r, ic, dr, dv, t)
+        np.take(m, i, out=m1, mode='clip')
+        np.take(m, j, out=m2, mode='clip')
+        np.add(m1, m2, out=m_s)
+        np.multiply(dr, dr, out=t)
+        np.add(t[0], t[1], out=dr_norm_sq)
+        np.sqrt(dr_norm_sq, out=dr_norm_sq)
+        np.square(dr_norm_sq, out=dr_norm_sq)
+
+        # v1new = v1 - (sum((2 * m2 / m_s) * (v1 - v2) * dr) * dr) / dr_norm_sq
+        np.multiply(m2, 2, out=m2)
+        np.divide(m2, m_s, out=m2)
+        np.multiply(m1, 2, out=m1)
+        np.divide(m1, m_s, out=m1)
+        np.subtract(v1, v2, out=dv)
+        for coef, sign, x in ((m2, 1, v1), (m1, -1, v2)):
+            np.multiply(coef, dv if sign > 0 else np.negative(dv, out=t), out=t)
+            np.multiply(t, dr, out=t)
+            np.add(t[0], t[1], out=m_s)
+            np.multiply(m_s, dr, out=t)
+            np.divide(t, dr_norm_sq, out=t)
+            np.subtract(x, t, out=x)
+        v[:, i] = v1
+        v[:, j] = v2
+
+
+@lru_cache(maxsize=64)
+def _spring_length_cdf(k: float, k_boltz: float, l_0: float, gamma: float, T: float) -> Tuple[ndarray, ndarray]:
+    """
+    :return: grid of the spring lengths and the normalized CDF of the equilibrium length distribution on it,
+    both arrays are read-only as they are shared by the cache
+    """
+    def f(l):
+        return np.exp(-k * (np.abs(l - l_0) ** (gamma + 1)) / (2 * k_boltz * T * (gamma + 1)))
+
+    r_sp = np.linspace(0, 0.5, num=10_000)
+    F = integrate.cumulative_trapezoid(y=f(r_sp), x=r_sp, initial=0)
+    F /= F[-1]
+    r_sp.flags.writeable = False
+    F.flags.writeable = False
+    return r_sp, F
+
+
+def _align(size: int) -> int:
+    return -(-size // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+
+
+if __name__ == '__main__':
+    # python -m simulation run ...
+    import cli
+    cli.main()
@@ -33,10 +33,19 @@ class ParamSlider:
         self.slider.draw()
         val = self.dec_round(self.slider.getValue())
         params[self.name_par] = val
-        self.sl_val._prep_msg(str(val))
+        if str(val) != self.sl_val.msg:
+            self.sl_val._prep_msg(str(val))
         self.sl_val.draw_button()
         self.par_name.draw_button()
 
+    @property
+    def rect(self) -> pygame.Rect:
+        """
+        Area drawn by draw_check except the parameter name: the track, the handle and the value
+        """
+        track = self.slider.container_rect.inflate(self.slider.button_rect.width, 0)
+        return track.union(self.sl_val.rect).union(self.sl_val.msg_image_rect)
+
     def getValue(self):
         return self.dec_round(self.slider.getValue())
 
@@ -0,0 +1,194 @@
+"""
+Parameter sweep over the (gamma, T, k, m_spring) space.
+Every grid point is simulated in a separate worker process with its own random stream,
+the results are appended to a csv table as soon as they are ready.
+
+Usage: python sweep.py --grid gamma=0.5,1,2 T=100,350 --steps 50000 --out sweep.csv
+"""
+import argparse
+import csv
+import itertools
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List
+
+import numpy as np
+from numpy import ndarray
+
+import config
+from simulation import Simulation
+
+SWEEP_PARAMS = ("gamma", "T", "k", "m_spring")
+RESULT_FIELDS = ("mean_kinetic", "expected_kinetic", "kinetic_error",
+                 "mean_potential", "expected_potential", "potential_error")
+
+
+def batch_means_error(samples: ndarray, n_batches: int = 20) -> float:
+    """
+    Standard error of the mean of the correlated samples estimated by the batch means method
+    """
+    batch = samples.shape[0] // n_batches
+    if batch == 0:
+        return float('nan')
+    means = samples[:batch * n_batches].reshape(n_batches, batch).mean(axis=1)
+    return float(np.std(means, ddof=1) / np.sqrt(n_batches))
+
+
+def run_point(params: dict, consts: dict, steps: int, burn_in: int, seed: np.random.SeedSequence) -> dict:
+    """
+    Simulates one grid point
+    :param params: full set of the demo parameters (see Simulation.from_params)
+    :param consts: l_0, R_size, R_mass config records and optional Simulation keyword arguments
+    :return: params with the energies, their expected values and error estimates
+    """
+    simulation = Simulation.from_params(params, seed=seed, **consts)
+    simulation.step_many(burn_in, record_every=max(burn_in, 1))
+    observables = simulation.step_many(steps)
+    kinetic, potential = observables.kinetic, observables.potential
+
+    return dict(
+        params,
+        mean_kinetic=float(np.mean(kinetic)),
+        expected_kinetic=simulation.expected_kinetic_energy(),
+        kinetic_error=batch_means_error(kinetic),
+        mean_potential=float(np.mean(potential)),
+        expected_potential=simulation.expected_potential_energy(),
+        potential_error=batch_means_error(potential),
+    )
+
+
+def make_grid(grid: Dict[str, List[float]], base: dict) -> List[dict]:
+    """
+    :param grid: values of every swept parameter, the other parameters are taken from base
+    :return: params of all the grid points
+    """
+    for name in grid:
+        if name not in SWEEP_PARAMS:
+            raise ValueError(f"sweep parameter must be one of {SWEEP_PARAMS}")
+    names = list(grid)
+    return [dict(base, **dict(zip(names, values))) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def _point_key(params: dict) -> tuple:
+    return tuple(float(params[name]) for name in SWEEP_PARAMS)
+
+
+def _finished_points(out_path: str) -> set:
+    """
+    Drops the "failed" and "error" rows of the out_path table, their points are run again,
+    so every point keeps one row
+    :return: keys of the points with the "ok" rows
+    """
+    if not os.path.exists(out_path):
+        return set()
+    with open(out_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    ok = [row for row in rows if row["status"] == "ok"]
+    if len(ok) < len(rows):
+        tmp_path = f"{out_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            writer.writerows(ok)
+        os.replace(tmp_path, out_path)
+    return {_point_key(row) for row in ok}
+
+
+def run_sweep(grid: Dict[str, List[float]], out_path: str, steps: int, burn_in: int = 0, seed: int = 0,
+              workers: int = None, max_retries: int = 2, base: dict = None, consts: dict = None):
+    """
+    Runs the sweep on a process pool and streams the results to the out_path csv table.
+    Points already present in the table are skipped, so an interrupted sweep can be resumed,
+    the "failed" and "error" rows are removed and their points are run again.
+    If a worker crashes the pool is broken and it's not known which point has killed it, so the unfinished
+    points are rerun one per pool. A crash of such a pool is charged to its point only, the point is rerun
+    at most max_retries times, after that it's written with the "failed" status.
+    :param seed: root seed, the point i gets the i-th child stream of it
+    :param workers: number of worker processes, all the cores by default
+    """
+    loader = config.ConfigLoader()
+    if base is None:
+        base = loader.initial_sim_params()
+    if consts is None:
+        consts = dict(l_0=loader['l_0'], R_size=loader['R_size'], R_mass=loader['R_mass'])
+
+    points = make_grid(grid, base)
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    done = _finished_points(out_path)
+    pending = {i: 0 for i, point in enumerate(points) if _point_key(point) not in done}
+
+    fields = list(base) + list(RESULT_FIELDS) + ["status"]
+    new_file = not os.path.exists(out_path)
+    with open(out_path, "a", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+
+        def write(i: int, future: Future):
+            error = future.exception()
+            if error is not None:
+                row = dict(points[i], status=f"error: {error}")
+            else:
+                row = dict(future.result(), status="ok")
+            writer.writerow(row)
+            f.flush()
+            del pending[i]
+
+        unfinished = deque()
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(run_point, points[i], consts, steps, burn_in, seeds[i]): i for i in pending}
+            for future in as_completed(futures):
+                if isinstance(future.exception(), BrokenProcessPool):
+                    unfinished.append(futures[future])
+                else:
+                    write(futures[future], future)
+
+        running = {}
+        while unfinished or running:
+            while unfinished and len(running) < (workers or os.cpu_count()):
+                i = unfinished.popleft()
+                pool = ProcessPoolExecutor(max_workers=1)
+                running[pool.submit(run_point, points[i], consts, steps, burn_in, seeds[i])] = i, pool
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i, pool = running.pop(future)
+                pool.shutdown()
+                if isinstance(future.exception(), BrokenProcessPool):
+                    # The point has killed its own pool
+                    pending[i] += 1
+                    if pending[i] <= max_retries:
+                        unfinished.append(i)
+                        continue
+                    writer.writerow(dict(points[i], status="failed"))
+                    f.flush()
+                    del pending[i]
+                else:
+                    write(i, future)
+
+
+def _parse_grid(items: List[str]) -> Dict[str, List[float]]:
+    grid = {}
+    for item in items:
+        name, values = item.split("=")
+        grid[name] = [float(v) for v in values.split(",")]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep of the simulation")
+    parser.add_argument("--grid", nargs="+", required=True, help="name=v1,v2,... for gamma, T, k, m_spring")
+    parser.add_argument("--steps", type=int, default=50_000, help="number of the averaged steps")
+    parser.add_argument("--burn-in", type=int, default=5_000, help="number of the steps before the averaging")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="sweep.csv")
+    args = parser.parse_args()
+
+    run_sweep(_parse_grid(args.grid), args.out, args.steps, args.burn_in, args.seed, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from accumulators import RunningStats
+
+
+@pytest.mark.parametrize("pushed", [0, 5, 16, 40])
+@pytest.mark.parametrize("shape", [(), (3, )])
+def test_state_round_trip(pushed, shape):
+    values = np.random.default_rng(pushed).random((pushed + 30, ) + shape)
+    stats = RunningStats(16, shape)
+    for value in values[:pushed]:
+        stats.push(value)
+    state = stats.state()
+    assert state["prefix"].shape[0] == min(pushed, 16) + 1
+    restored = RunningStats.from_state(state)
+    for value in values[pushed:]:
+        stats.push(value)
+        restored.push(value)
+    for frames_c in [None] + list(range(1, 17)):
+        np.testing.assert_array_equal(restored.mean(frames_c), stats.mean(frames_c))
+    np.testing.assert_array_equal(restored.var(), stats.var())
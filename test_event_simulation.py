@@ -0,0 +1,18 @@
+import numpy as np
+
+import config
+from event_simulation import EventSimulation
+
+
+def test_resume_is_bit_exact(tmp_path):
+    loader = config.ConfigLoader()
+    run = EventSimulation.from_params(loader.initial_sim_params(), l_0=loader['l_0'], R_size=loader['R_size'],
+                                      R_mass=loader['R_mass'], seed=0, dt=1e-3)
+    run.step_many(3)
+    run.save(str(tmp_path / "run.snap"))
+    resumed = EventSimulation.load(str(tmp_path / "run.snap"))
+    run.step_many(5)
+    resumed.step_many(5)
+    np.testing.assert_array_equal(resumed._r, run._r)
+    np.testing.assert_array_equal(resumed._v, run._v)
+    assert resumed.time == run.time
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from equivalence import brute_force_pairs, check_energy
+from simulation import Simulation, _Workspace
+
+
+@pytest.mark.parametrize("workspace", [False, True])
+@pytest.mark.parametrize("index_dtype", [np.intp, np.int32])
+@pytest.mark.parametrize("n, cutoff", [(1, 0.02), (50, 0.0), (50, 0.02), (200, 0.02), (500, 0.01), (300, 0.3),
+                                       (1000, 0.004), (100, 2.0)])
+@pytest.mark.parametrize("case", ["same", "cross", "same_groups", "cross_groups"])
+def test_contact_pairs_match_brute_force(case, n, cutoff, index_dtype, workspace):
+    rng = np.random.default_rng(n)
+    r_a, r_b = rng.random((2, n)), rng.random((2, n // 2 + 1))
+    groups_a, groups_b = rng.integers(0, 3, n), rng.integers(0, 3, n // 2 + 1)
+    a, b, kwargs = dict(same=(r_a, r_a, dict(same=True)),
+                        cross=(r_a, r_b, {}),
+                        same_groups=(r_a, r_a, dict(same=True, groups_a=groups_a)),
+                        cross_groups=(r_a, r_b, dict(groups_a=groups_a, groups_b=groups_b)))[case]
+    if workspace:
+        kwargs["workspace"] = _Workspace(b.shape[1], index_dtype=index_dtype)
+    found = Simulation.get_contact_pairs(a, b, cutoff, index_dtype=index_dtype, **kwargs)
+    kwargs.pop("workspace", None)
+    assert found.dtype == index_dtype
+    np.testing.assert_array_equal(found, brute_force_pairs(a, b, cutoff, **kwargs))
+
+
+@pytest.mark.parametrize("n_spring", [0, 1, 2, 6])
+def test_spring_contact_pairs_match_brute_force(n_spring):
+    r = np.random.default_rng(n_spring).random((2, 400))
+    R, R_spring = 0.01, 0.1
+    ic_spring, ic_spring_particles = Simulation._spring_contact_pairs(r, n_spring, R, R_spring)
+    np.testing.assert_array_equal(ic_spring, brute_force_pairs(r[:, :n_spring], r[:, :n_spring], 2 * R_spring,
+                                                               same=True))
+    expected = brute_force_pairs(r[:, :n_spring], r[:, n_spring:], R + R_spring)
+    expected[:, 1] += n_spring
+    np.testing.assert_array_equal(ic_spring_particles, expected)
+
+
+def test_multiple_contacts_conserve_energy():
+    assert check_energy(seeds=0, steps=0) == 0
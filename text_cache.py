@@ -0,0 +1,55 @@
+"""
+Shared system fonts and rendered text surfaces.
+
+The screens are rebuilt on every language switch, so the same fonts are resolved by name and the same labels
+are rendered many times. The fonts are kept for the whole run, the text surfaces are kept in a bounded LRU cache.
+"""
+from collections import OrderedDict
+
+import pygame
+from py_singleton import singleton
+
+
+@singleton
+class TextCache(object):
+    # Max number of the kept text surfaces, the least recently used ones are dropped
+    MAX_SURFACES = 512
+
+    def __init__(self):
+        self._fonts = {}
+        self._surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, name: str, size: int, bold: bool = False, italic: bool = False) -> pygame.font.Font:
+        """
+        :return: pygame.font.SysFont(name, size, bold, italic) resolved once per run
+        """
+        key = (name, size, bool(bold), bool(italic))
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = pygame.font.SysFont(name, size, bold, italic)
+        return font
+
+    def render(self, text: str, name: str, size: int, bold: bool = False, color=(0, 0, 0), background=None,
+               antialias: bool = True) -> pygame.Surface:
+        """
+        Font(name, size, bold).render(text, antialias, color, background) rendered once while it's in the cache.
+        The surface is shared by all the callers, it must not be drawn on
+        """
+        key = (text, name, size, bool(bold), tuple(pygame.Color(color)),
+               None if background is None else tuple(pygame.Color(background)), antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.font(name, size, bold).render(text, antialias, color, background)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.MAX_SURFACES:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
@@ -0,0 +1,191 @@
+"""
+Binary trajectory of a simulation run and its random-access replay.
+
+The data file is a sequence of chunks, each chunk is a C-ordered float64 matrix
+with one row per recorded frame: [f, E_kin, E_pot, r.ravel(), v.ravel()].
+Within a chunk the number of particles, the radii and the time step are fixed, a change of them starts a new chunk.
+The small json index "<path>.idx" keeps the chunk offsets, so any frame is located without scanning the file.
+"""
+import json
+import os
+from typing import List, NamedTuple
+
+import numpy as np
+from numpy import ndarray
+
+# Row columns before the positions
+_HEAD = 3
+
+
+class Frame(NamedTuple):
+    step: int
+    f: float
+    kinetic: float
+    potential: float
+    r: ndarray
+    v: ndarray
+    n_spring: int
+    R: float
+    R_spring: float
+    bonds: ndarray
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, every: int = 1, chunk_frames: int = 256):
+        """
+        Records every every-th step of the simulation it is attached to (simulation.recorder = recorder).
+        Rows are written into a memory-mapped chunk of chunk_frames preallocated rows,
+        the index is rewritten only when a chunk is filled or closed
+        :param path: data file, it is overwritten
+        """
+        if every < 1 or chunk_frames < 1:
+            raise ValueError("every and chunk_frames must be positive")
+        self.path = path
+        self.every = every
+        self.chunk_frames = chunk_frames
+        self._file = open(path, "wb+")
+        self._chunks = []
+        self._buf = None
+        self._filled = 0
+        self._key = None
+        self._step = 0
+
+    def record(self, simulation, f: float, kinetic: float, potential: float):
+        """
+        Called by the simulation after every step with the observables it has already computed
+        """
+        self._step += 1
+        if self._step % self.every:
+            return
+        r, v = simulation._r, simulation._v
+        key = (r.shape[1], simulation._n_spring, simulation.R, simulation.R_spring, simulation.dt)
+        if key != self._key or self._filled == self.chunk_frames:
+            self._new_chunk(key, simulation.bonds)
+
+        row = self._buf[self._filled]
+        n2 = r.size
+        row[0] = f
+        row[1] = kinetic
+        row[2] = potential
+        row[_HEAD:_HEAD + n2].reshape(r.shape)[...] = r
+        row[_HEAD + n2:].reshape(v.shape)[...] = v
+        self._filled += 1
+        self._chunks[-1]["frames"] = self._filled
+
+    def _new_chunk(self, key: tuple, bonds: ndarray):
+        self._close_chunk()
+        n, n_spring, R, R_spring, dt = key
+        row_len = _HEAD + 4 * n
+        offset = self._chunks[-1]["offset"] + self._chunks[-1]["frames"] * self._chunks[-1]["row_len"] * 8 \
+            if self._chunks else 0
+        self._file.truncate(offset + self.chunk_frames * row_len * 8)
+        self._buf = np.memmap(self._file, dtype=np.float64, mode="r+", offset=offset,
+                              shape=(self.chunk_frames, row_len))
+        self._filled = 0
+        self._key = key
+        self._chunks.append(dict(offset=offset, frames=0, first_step=self._step, every=self.every, dt=dt,
+                                 n=n, n_spring=n_spring, R=R, R_spring=R_spring, bonds=bonds.tolist(),
+                                 row_len=row_len))
+
+    def _close_chunk(self):
+        if self._buf is None:
+            return
+        self._buf.flush()
+        self._buf = None
+        self._write_index()
+
+    def _write_index(self):
+        tmp_path = f"{self.path}.idx.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": self._chunks}, f)
+        os.replace(tmp_path, f"{self.path}.idx")
+
+    def close(self):
+        """
+        Flushes the last chunk and cuts off its unused rows
+        """
+        if self._file.closed:
+            return
+        self._close_chunk()
+        size = self._chunks[-1]["offset"] + self._chunks[-1]["frames"] * self._chunks[-1]["row_len"] * 8 \
+            if self._chunks else 0
+        self._file.truncate(size)
+        self._file.close()
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    def __init__(self, path: str):
+        """
+        Random access to the frames of a trajectory written by TrajectoryRecorder,
+        the chunks are memory-mapped read-only on the first access
+        """
+        with open(f"{path}.idx", "r", encoding="utf-8") as f:
+            self._chunks: List[dict] = [c for c in json.load(f)["chunks"] if c["frames"]]
+        self.path = path
+        self._maps = [None] * len(self._chunks)
+        # Global number of the first frame of every chunk
+        self._starts = np.cumsum([0] + [c["frames"] for c in self._chunks])
+        self._energy = None
+        self._energy_cum = None
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def _chunk(self, c: int) -> ndarray:
+        if self._maps[c] is None:
+            chunk = self._chunks[c]
+            self._maps[c] = np.memmap(self.path, dtype=np.float64, mode="r", offset=chunk["offset"],
+                                      shape=(chunk["frames"], chunk["row_len"]))
+        return self._maps[c]
+
+    def _locate(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("frame index out of range")
+        c = int(np.searchsorted(self._starts, i, side="right")) - 1
+        return c, i - int(self._starts[c])
+
+    def __getitem__(self, i: int) -> Frame:
+        c, pos = self._locate(i)
+        chunk = self._chunks[c]
+        row = self._chunk(c)[pos]
+        n = chunk["n"]
+        return Frame(
+            step=chunk["first_step"] + pos * chunk["every"],
+            f=float(row[0]), kinetic=float(row[1]), potential=float(row[2]),
+            r=row[_HEAD:_HEAD + 2 * n].reshape(2, n), v=row[_HEAD + 2 * n:].reshape(2, n),
+            n_spring=chunk["n_spring"], R=chunk["R"], R_spring=chunk["R_spring"],
+            bonds=np.array(chunk["bonds"], dtype=int).reshape(-1, 2),
+        )
+
+    def time(self, i: int) -> float:
+        c, pos = self._locate(i)
+        chunk = self._chunks[c]
+        return (chunk["first_step"] + pos * chunk["every"]) * chunk["dt"]
+
+    def energies(self) -> ndarray:
+        """
+        :return: (frames, 2) array of the kinetic and potential energies of all the frames
+        """
+        if self._energy is None:
+            self._energy = np.vstack([self._chunk(c)[:, 1:_HEAD] for c in range(len(self._chunks))]) \
+                if self._chunks else np.zeros((0, 2))
+            self._energy_cum = np.vstack([np.zeros((1, 2)), np.cumsum(self._energy, axis=0)])
+        return self._energy
+
+    def mean_energies(self, i: int, frames_c: int = None) -> ndarray:
+        """
+        :return: kinetic and potential energies averaged over the frames up to i,
+        or over the last frames_c of them
+        """
+        self.energies()
+        start = 0 if frames_c is None else max(i + 1 - frames_c, 0)
+        return (self._energy_cum[i + 1] - self._energy_cum[start]) / (i + 1 - start)